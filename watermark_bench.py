@@ -0,0 +1,271 @@
+"""
+性能基准：生成固定的测试素材，分别计时各个处理函数和整目录处理，结果保存为 JSON，便于比较不同版本的快慢。
+
+素材每次生成的内容相同（固定随机种子），生成一次后缓存在素材目录中：
+    JPEG 2/12/48 百万像素，带与不带 EXIF 拍摄时间；带透明通道的 PNG；水印 logo；本机有 ffmpeg 时生成几秒的 mp4。
+
+示例：
+    python watermark_bench.py --out bench_v1.json
+    python watermark_bench.py --out bench_v2.json --compare bench_v1.json
+    python watermark_bench.py --sizes 2 12 --repeat 5 --font C:/Windows/Fonts/simsun.ttc
+
+--compare 时比较各项的中位耗时，变慢超过 --threshold（默认 10%）的项目视为回退，退出码为 1；
+有文件处理失败的项目（如找不到字体）记为失败，不参与快慢比较，本次失败也视为回退。
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import PIL
+from PIL import Image, ImageDraw
+
+from watermark_core import (get_ffmpeg_tool_path, run_ffmpeg_command, add_text_watermark2,
+                            add_text_watermark_with_date, add_image_watermark, compress_photo, add_watermark_ffmpeg,
+                            compress_video, process_directory, compress_process_directory)
+
+# 素材内容或生成方式变化时加 1，旧的缓存素材会被重新生成
+CORPUS_VERSION = 1
+MEGAPIXEL_SIZES = {2: (1632, 1224), 12: (4000, 3000), 48: (8000, 6000)}
+EXIF_DATETIME = 306
+
+
+def _synthetic_image(size, seed, mode='RGB'):
+    """用固定种子绘制渐变加色块的图像，内容可重复，也不像纯色图那样被编码器过度压缩"""
+    rng = random.Random(seed)
+    width, height = size
+    gradient = Image.linear_gradient('L').resize(size)
+    image = Image.merge('RGB', (gradient, gradient.rotate(90).resize(size), Image.radial_gradient('L').resize(size)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(200):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(width // 20 + 1, width // 4 + 2), rng.randrange(height // 20 + 1, height // 4 + 2)
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        if rng.random() < 0.5:
+            draw.rectangle((x, y, x + w, y + h), fill=color)
+        else:
+            draw.ellipse((x, y, x + w, y + h), fill=color)
+    if mode == 'RGBA':
+        image.putalpha(Image.radial_gradient('L').resize(size))
+    return image
+
+
+def build_corpus(corpus_dir, sizes=(2, 12, 48), with_video=True):
+    """
+    生成测试素材，已生成且版本一致时直接复用
+    :param corpus_dir: 素材目录
+    :param sizes: JPEG 的百万像素档位
+    :param with_video: 是否生成 mp4（需要本机 ffmpeg）
+    :return: 素材说明 {'photos': {名称: 路径}, 'logo': 路径, 'videos': {名称: 路径}}
+    """
+    marker = os.path.join(corpus_dir, 'corpus.json')
+    try:
+        with open(marker, 'r', encoding='utf-8') as f:
+            corpus = json.load(f)
+        if corpus.get('version') == CORPUS_VERSION and corpus.get('sizes') == list(sizes) \
+                and corpus.get('with_video') == with_video:
+            return corpus
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    photo_dir = os.path.join(corpus_dir, 'photos', '巡检素材')
+    video_dir = os.path.join(corpus_dir, 'videos', '巡检视频')
+    os.makedirs(photo_dir)
+    corpus = {'version': CORPUS_VERSION, 'sizes': list(sizes), 'with_video': with_video, 'photos': {},
+              'videos': {}}
+    for megapixels in sizes:
+        image = _synthetic_image(MEGAPIXEL_SIZES[megapixels], megapixels)
+        exif = Image.Exif()
+        exif[EXIF_DATETIME] = '2024:05:01 08:30:00'
+        for name, params in ((f'jpeg_{megapixels}mp_exif', {'exif': exif}), (f'jpeg_{megapixels}mp', {})):
+            path = os.path.join(photo_dir, f'{name}.jpg')
+            image.save(path, quality=90, **params)
+            corpus['photos'][name] = path
+    path = os.path.join(photo_dir, 'png_2mp_alpha.png')
+    _synthetic_image(MEGAPIXEL_SIZES[2], 1000, 'RGBA').save(path)
+    corpus['photos']['png_2mp_alpha'] = path
+    logo = _synthetic_image((400, 160), 2000, 'RGBA')
+    corpus['logo'] = os.path.join(corpus_dir, 'logo.png')
+    logo.save(corpus['logo'])
+    ffmpeg_path = get_ffmpeg_tool_path('ffmpeg')
+    if with_video and ffmpeg_path and os.path.exists(ffmpeg_path):
+        os.makedirs(video_dir)
+        for name, size in (('mp4_720p', '1280x720'), ('mp4_1080p', '1920x1080')):
+            path = os.path.join(video_dir, f'{name}.mp4')
+            result = run_ffmpeg_command(
+                rf'"{ffmpeg_path}" -y -f lavfi -i testsrc2=size={size}:rate=30 -f lavfi -i sine=frequency=440 '
+                rf'-t 3 -c:v libx264 -preset veryfast -pix_fmt yuv420p -c:a aac -shortest "{path}"')
+            if result.returncode == 0:
+                corpus['videos'][name] = path
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(corpus, f, ensure_ascii=False, indent=1)
+    return corpus
+
+
+def _time_operation(func, repeat):
+    """重复执行 func，返回耗时统计；func 返回 False 或 None 时记为失败（有文件处理失败的结果不能用于比较快慢）"""
+    times = []
+    success = True
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+        success = success and bool(result)
+    return {
+        'success': success,
+        'repeat': repeat,
+        'min': round(min(times), 6),
+        'median': round(statistics.median(times), 6),
+        'max': round(max(times), 6),
+    }
+
+
+def _operations(corpus, work_dir, font):
+    """列出要计时的操作：(名称, 无参函数)"""
+    operations = []
+    for name, path in corpus['photos'].items():
+        ext = os.path.splitext(path)[1]
+        out = os.path.join(work_dir, f'out{ext}')
+        operations.append((f'add_text_watermark2/{name}', lambda p=path, o=out: add_text_watermark2(
+            p, o, '春季巡检', 40, 1, 20, 40, 0, 'FFFFFF', font)))
+        operations.append((f'add_text_watermark_with_date/{name}', lambda p=path, o=out: add_text_watermark_with_date(
+            p, o, '春季巡检', 0, 40, 1, 20, 40, 0, 'FFFFFF', font)))
+        operations.append((f'add_image_watermark/{name}', lambda p=path, o=out: add_image_watermark(
+            p, o, corpus['logo'], 1)))
+        operations.append((f'compress_photo_pillow/{name}', lambda p=path, o=out: compress_photo(
+            p, o, 60, 'scale_size', 50)))
+    for name, path in corpus['videos'].items():
+        out = os.path.join(work_dir, 'out.mp4')
+        operations.append((f'add_watermark_ffmpeg/{name}', lambda p=path: add_watermark_ffmpeg(
+            p, out, '春季巡检', font_type=font)))
+        operations.append((f'compress_video/{name}', lambda p=path: compress_video(p, out, 60, 'fast')))
+    photo_root = os.path.dirname(os.path.dirname(next(iter(corpus['photos'].values()))))
+    out_root = os.path.join(work_dir, 'out_dir')
+
+    def run_driver(driver, root, **kwargs):
+        # 整目录处理函数不通过返回值报告单个文件失败，按进度回调统计，有文件失败时整项记为失败
+        shutil.rmtree(out_root, ignore_errors=True)
+        statuses = []
+        driver(root, out_root, progress_func=lambda status, input_path, output_path: statuses.append(status),
+               **kwargs)
+        return bool(statuses) and 'failed' not in statuses
+
+    operations.append(('process_directory/text', lambda: run_driver(
+        process_directory, photo_root, out_file_name='巡检', text_color_hex='FFFFFF', font_type=font)))
+    operations.append(('process_directory/image', lambda: run_driver(
+        process_directory, photo_root, watermark_type='image', watermark_image_path=corpus['logo'])))
+    operations.append(('compress_process_directory', lambda: run_driver(
+        compress_process_directory, photo_root, out_file_name=None, is_add_video_water=False, quality=60,
+        deal_size_way='scale_size', scale=50)))
+    if corpus['videos']:
+        video_root = os.path.dirname(os.path.dirname(next(iter(corpus['videos'].values()))))
+        operations.append(('process_directory/video', lambda: run_driver(
+            process_directory, video_root, is_add_video_water=True, font_type=font)))
+    return operations
+
+
+def _git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(corpus_dir, sizes=(2, 12, 48), repeat=3, font='simsun.ttc', with_video=True, only=None):
+    """
+    生成素材并计时所有操作
+    :param only: 只运行名称包含其中任一字符串的操作，None 表示全部
+    :return: 结果字典：环境信息和每项操作的耗时统计
+    """
+    corpus = build_corpus(corpus_dir, tuple(sizes), with_video)
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, func in _operations(corpus, work_dir, font):
+            if only and not any(keyword in name for keyword in only):
+                continue
+            results[name] = _time_operation(func, repeat)
+            status = '' if results[name]['success'] else ' (失败)'
+            print(f"{name}: {results[name]['median']:.3f} 秒{status}", file=sys.stderr, flush=True)
+    return {
+        'corpus_version': CORPUS_VERSION,
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results,
+    }
+
+
+def compare_results(current, baseline, threshold=0.10):
+    """
+    按中位耗时比较两次结果；任一次失败的项目不比较快慢，本次失败的项目视为回退
+    :return: [(名称, 基准耗时, 本次耗时, 比值)]，以及变慢超过 threshold 或本次失败的名称列表
+    """
+    rows = []
+    regressions = [name for name, result in current['results'].items() if not result['success']]
+    for name, result in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base or not base['median'] or not base.get('success', True) or not result['success']:
+            continue
+        ratio = result['median'] / base['median']
+        rows.append((name, base['median'], result['median'], ratio))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='watermark_bench', description='批量加水印工具性能基准')
+    parser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'watermark_bench_corpus'),
+                        help='素材目录，默认在系统临时目录下')
+    parser.add_argument('--sizes', type=int, nargs='+', choices=sorted(MEGAPIXEL_SIZES), default=[2, 12, 48],
+                        help='JPEG 百万像素档位')
+    parser.add_argument('--repeat', type=int, default=3, help='每项操作重复次数，取中位数比较')
+    parser.add_argument('--font', default='simsun.ttc', help='文字水印字体文件名或路径')
+    parser.add_argument('--no-video', action='store_true', help='不生成、不测试视频')
+    parser.add_argument('--only', nargs='+', default=None, help='只运行名称包含这些字符串的操作')
+    parser.add_argument('--out', default=None, help='结果 JSON 文件，默认只输出到标准输出')
+    parser.add_argument('--compare', default=None, help='用作基准的结果 JSON 文件')
+    parser.add_argument('--threshold', type=float, default=0.10, help='中位耗时变慢超过该比例视为回退')
+    args = parser.parse_args(argv)
+
+    # 处理函数中的 print 输出转到标准错误，标准输出只保留结果
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_benchmarks(args.corpus, args.sizes, max(args.repeat, 1), args.font, not args.no_video,
+                                args.only)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+    print(json.dumps(report, ensure_ascii=False, indent=1))
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('corpus_version') != CORPUS_VERSION:
+            print("警告: 基准结果使用的素材版本不同，比较结果仅供参考", file=sys.stderr)
+        rows, regressions = compare_results(report, baseline, args.threshold)
+        for name, base, current, ratio in rows:
+            flag = '  <-- 变慢' if name in regressions else ''
+            print(f"{name}: {base:.3f} -> {current:.3f} 秒 (x{ratio:.2f}){flag}", file=sys.stderr)
+        for name, result in report['results'].items():
+            if not result['success']:
+                print(f"{name}: 处理失败，未比较耗时", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+批量加水印工具的命令行入口，不依赖 tkinter，可在无界面的服务器上运行。
+
+每个文件处理结束后向标准输出写一行 JSON 进度，运行结束时写一行汇总；日志信息写到标准错误。
+有文件处理失败时退出码为 1，参数错误时为 2。
+按 Ctrl+C（或收到 SIGTERM）时取消：终止正在运行的 ffmpeg、删除未完成的输出并写出汇总，退出码为 130；再按一次立即退出。
+加 --watch 时持续监视源目录并处理新写入的文件，Ctrl+C 停止监视，退出码为 0（有文件失败时为 1）。
+
+示例：
+    python watermark_cli.py text D:\\2024巡检 --out D:\\2025巡检 --name 2025春季巡检 --video
+    python watermark_cli.py image D:\\2024巡检 --out D:\\out --image logo.png --position 1
+    python watermark_cli.py compress D:\\2024巡检 --out D:\\out --quality 60 --size-mode scale_size --scale 50
+    python watermark_cli.py text D:\\收件箱 --out D:\\已加水印 --watch
+    python watermark_cli.py bench-video sample.mp4 --profiles fast balanced
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from watermark_core import (DEDUP_MODES, PASSTHROUGH_MODES, PHOTO_SUBSAMPLING, VIDEO_PROFILES, ProgressTracker,
+                            RunControl, is_color, convert_color_to_numeric, is_valid_watermark_image,
+                            process_directory, compress_process_directory, benchmark_video_profiles,
+                            photo_encode_options, is_watermark_target, watch_directory, ignore_interrupt)
+
+PHOTO_FORMATS = {'original': 0, 'png': 1, 'jpeg': 2, 'webp': 3}
+VIDEO_FORMATS = {'original': 0, 'mp4': 1, 'avi': 2, 'mov': 3, 'flv': 4, 'wmv': 5, 'mpeg': 6, 'mpg': 7}
+CROP_CENTERS = {'center': 0, 'top_left': 1, 'top_right': 2, 'bottom_left': 3, 'bottom_right': 4}
+
+
+class ProgressReporter:
+    """把每个文件的处理结果以 JSON 行的形式写到输出流，并统计成功、失败和跳过的数量"""
+
+    def __init__(self, stream, tracker=None):
+        """
+        :param tracker: ProgressTracker；总数统计完成后，每行进度附带文件总数和预计剩余秒数
+        """
+        self.stream = stream
+        self.tracker = tracker
+        self.counts = {'ok': 0, 'failed': 0, 'skipped': 0, 'cancelled': 0}
+        self.start = time.perf_counter()
+
+    def _write(self, record):
+        self.stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.stream.flush()
+
+    def __call__(self, status, input_path, output_path):
+        self.counts[status] += 1
+        record = {'event': 'file', 'status': status, 'src': input_path, 'dst': output_path,
+                  'done': sum(self.counts.values())}
+        if self.tracker is not None and self.tracker.total_known:
+            eta = self.tracker.eta()
+            record.update(total=self.tracker.total_files, eta=round(eta, 1) if eta is not None else None)
+        self._write(record)
+
+    def summary(self, control=None):
+        record = {'event': 'summary', 'ok': self.counts['ok'], 'failed': self.counts['failed'],
+                  'skipped': self.counts['skipped'], 'elapsed': round(time.perf_counter() - self.start, 3)}
+        if control is not None and control.cancelled:
+            record.update(cancelled=True, remaining=control.remaining)
+        self._write(record)
+
+
+def _add_common_arguments(parser):
+    parser.add_argument('root_dir', help='源文件根路径')
+    parser.add_argument('--out', dest='out_path', default=None, help='输出根路径，默认为"源路径_out"')
+    parser.add_argument('--name', dest='out_file_name', default=None, help='对输出文件进行重命名，默认使用原文件名')
+    parser.add_argument('--video', dest='is_add_video_water', action='store_true', help='同时处理视频')
+    parser.add_argument('--video-jobs', type=int, default=None, help='同时运行的 ffmpeg 进程数，默认自动选择')
+    parser.add_argument('--incremental', action='store_true', help='跳过上次已处理且未变化的文件')
+    parser.add_argument('--hash-files', action='store_true', help='增量处理时同时比较文件内容哈希')
+    parser.add_argument('--passthrough', choices=PASSTHROUGH_MODES, default='copy',
+                        help='不处理的视频的复制方式：copy=普通复制，fast=写时复制/内核复制，link=优先硬链接')
+    parser.add_argument('--metrics', dest='metrics_path', default=None,
+                        help='把每个文件的耗时指标和运行汇总写入该 JSON 行文件')
+    parser.add_argument('--dedup', choices=DEDUP_MODES, default=None,
+                        help='内容和参数相同的源文件只处理一次，其余输出从第一次的输出硬链接（link）或复制（copy）')
+    parser.add_argument('--watch', action='store_true',
+                        help='处理完已有文件后持续监视源目录，新文件写入完成后自动处理（自动启用 --incremental），Ctrl+C 停止')
+    parser.add_argument('--settle', type=float, default=2.0, help='监视模式下文件大小多少秒不变后视为写入完成')
+    parser.add_argument('--poll-interval', type=float, default=2.0,
+                        help='监视模式下不支持 inotify 时（如 Windows）遍历目录的间隔秒数')
+    parser.add_argument('--quiet', action='store_true', help='不输出日志，只输出 JSON 进度')
+
+
+def _add_watermark_arguments(parser):
+    parser.add_argument('--position', dest='txt_position', type=int, default=0, choices=range(4),
+                        help='水印位置：0=左下角，1=右下角，2=左上角，3=右上角')
+    parser.add_argument('--padding', type=int, default=20, help='水平边距')
+    parser.add_argument('--h-padding', type=int, default=40, help='垂直边距')
+    parser.add_argument('--workers', dest='max_workers', type=int, default=None,
+                        help='照片并行处理的进程数，默认使用 CPU 核数')
+    parser.add_argument('--memory-budget', dest='memory_budget_mb', type=int, default=None,
+                        help='同时处理的照片按头信息估算的内存上限（MB），超出的照片等待，超大的照片单独处理')
+    parser.add_argument('--photo-quality', type=int, default=None,
+                        help='照片输出质量 1-95（JPEG/WEBP），启用优化编码；不指定以下任一编码参数时沿用 Pillow 默认参数')
+    parser.add_argument('--subsampling', choices=PHOTO_SUBSAMPLING, default=None,
+                        help='JPEG 色度抽样，keep 沿用源照片的抽样方式（启用优化编码）')
+    parser.add_argument('--baseline', action='store_true', help='输出基线 JPEG，不使用渐进式（启用优化编码）')
+    parser.add_argument('--strip-metadata', action='store_true',
+                        help='不保留源照片的 EXIF 和 ICC 色彩配置（启用优化编码）')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='watermark_cli', description='批量加水印 / 压缩工具（命令行版）')
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    text = subparsers.add_parser('text', help='文字水印')
+    _add_common_arguments(text)
+    _add_watermark_arguments(text)
+    text.add_argument('--text', dest='insert_watermark', default=None, help='水印文字，默认使用文件夹名称并自动添加拍摄时间')
+    text.add_argument('--date-format', dest='out_date_format', type=int, default=0, choices=range(3),
+                      help='日期格式：0=2025年1月1日，1=2025-01-01，2=2025/1/1')
+    text.add_argument('--font', dest='font_type', default='simsun.ttc', help='字体文件名或路径')
+    text.add_argument('--font-size', type=int, default=40, help='字体大小')
+    text.add_argument('--video-text-mode', choices=['overlay', 'drawtext'], default='overlay',
+                      help='视频文字水印方式：overlay=与照片相同排版的预绘制图层，drawtext=ffmpeg 逐帧绘制')
+    text.add_argument('--color', dest='text_color_hex', default='FFFFFFFF', help='文字颜色（HEX）')
+
+    image = subparsers.add_parser('image', help='图像水印')
+    _add_common_arguments(image)
+    _add_watermark_arguments(image)
+    image.add_argument('--image', dest='watermark_image_path', required=True, help='水印图片路径')
+    image.add_argument('--wm-width', dest='watermark_width', type=int, default=0, help='水印宽度，0 表示按高度等比例')
+    image.add_argument('--wm-height', dest='watermark_height', type=int, default=0, help='水印高度，0 表示按宽度等比例')
+
+    compress = subparsers.add_parser('compress', help='压缩优化')
+    _add_common_arguments(compress)
+    compress.add_argument('--quality', type=int, default=75, help='压缩质量百分比 (0-100)')
+    compress.add_argument('--target-kb', type=int, default=None,
+                          help='照片大小上限（KB）：自动查找不超过该大小的最高质量，必要时缩小尺寸，忽略 --quality')
+    compress.add_argument('--photo-format', choices=PHOTO_FORMATS, default='original', help='图片输出格式')
+    compress.add_argument('--video-format', choices=VIDEO_FORMATS, default='original', help='视频输出格式')
+    compress.add_argument('--size-mode', dest='deal_size_way', default='original_size',
+                          choices=['original_size', 'scale_size', 'specify_size', 'crop_size'], help='图片尺寸处理方式')
+    compress.add_argument('--scale', type=int, default=100, help='百分比缩放比例')
+    compress.add_argument('--width', type=int, default=1080, help='非等比例缩放宽度')
+    compress.add_argument('--height', type=int, default=1920, help='非等比例缩放高度')
+    compress.add_argument('--crop-center', choices=CROP_CENTERS, default='center', help='裁剪参考点')
+    compress.add_argument('--crop-width', type=int, default=720, help='裁剪宽度')
+    compress.add_argument('--crop-height', type=int, default=720, help='裁剪高度')
+    compress.add_argument('--photo-engine', choices=['pillow', 'ffmpeg'], default='pillow',
+                          help='照片压缩方式：pillow 在进程内处理，ffmpeg 每张照片启动一次 ffmpeg')
+    compress.add_argument('--video-profile', choices=VIDEO_PROFILES, default=None,
+                          help='视频压缩配置：fast/balanced/archival，默认沿用固定码率参数')
+    compress.add_argument('--remux', dest='video_remux', action='store_true',
+                          help='只转换视频格式：编码与目标格式兼容时直接复制音视频流，不重新编码')
+
+    bench = subparsers.add_parser('bench-video', help='测试各视频压缩配置的编码速度和输出大小，不保留输出')
+    bench.add_argument('sample', help='样例视频')
+    bench.add_argument('--profiles', nargs='+', choices=VIDEO_PROFILES, default=None, help='要测试的配置，默认全部')
+    bench.add_argument('--quality', type=int, default=75, help='压缩质量百分比 (0-100)')
+    bench.add_argument('--threads', type=int, default=0, help='编码线程数，0 表示使用配置中的线程数（fast 2、balanced 4、archival 8）')
+    return parser
+
+
+def photo_encode_from_args(args):
+    """由命令行参数得到照片输出编码参数；没有指定任何编码参数时返回 None，沿用原来的保存方式"""
+    if args.photo_quality is None and args.subsampling is None and not args.baseline and not args.strip_metadata:
+        return None
+    return photo_encode_options(quality=args.photo_quality if args.photo_quality is not None else 85,
+                                progressive=not args.baseline, subsampling=args.subsampling or 'keep',
+                                keep_metadata=not args.strip_metadata)
+
+
+def run(args, progress, control=None, tracker=None, **extra):
+    def log_message(message, color='gray'):
+        # 监视模式下每次都会遍历整个目录，不输出已处理文件的跳过信息
+        if args.watch and message.startswith('已跳过'):
+            return
+        print(message, file=sys.stderr, flush=True)
+
+    log_func = None if args.quiet else log_message
+    common = dict(is_add_video_water=args.is_add_video_water, log_func=log_func, video_jobs=args.video_jobs,
+                  incremental=args.incremental, hash_files=args.hash_files, progress_func=progress,
+                  passthrough=args.passthrough, metrics_path=args.metrics_path, control=control,
+                  tracker=tracker, dedup=args.dedup, **extra)
+    if args.mode == 'compress':
+        compress_process_directory(args.root_dir, args.out_path, args.out_file_name, quality=args.quality,
+                                   photo_format=PHOTO_FORMATS[args.photo_format],
+                                   video_format=VIDEO_FORMATS[args.video_format], deal_size_way=args.deal_size_way,
+                                   scale=args.scale, width=args.width, height=args.height,
+                                   crop_center=CROP_CENTERS[args.crop_center], crop_width=args.crop_width,
+                                   crop_height=args.crop_height, photo_engine=args.photo_engine,
+                                   video_profile=args.video_profile, video_remux=args.video_remux,
+                                   target_kb=args.target_kb, **common)
+    elif args.mode == 'image':
+        process_directory(args.root_dir, args.out_path, args.out_file_name, txt_position=args.txt_position,
+                          padding=args.padding, h_padding=args.h_padding, watermark_type='image',
+                          watermark_image_path=args.watermark_image_path, watermark_width=args.watermark_width,
+                          watermark_height=args.watermark_height, max_workers=args.max_workers,
+                          memory_budget_mb=args.memory_budget_mb, photo_encode=args.photo_encode, **common)
+    else:
+        process_directory(args.root_dir, args.out_path, args.out_file_name, out_date_format=args.out_date_format,
+                          font_size=args.font_size, txt_position=args.txt_position, padding=args.padding,
+                          h_padding=args.h_padding, text_color_hex=convert_color_to_numeric(args.text_color_hex),
+                          insert_watermark=args.insert_watermark, font_type=args.font_type, watermark_type='text',
+                          max_workers=args.max_workers, video_text_mode=args.video_text_mode,
+                          memory_budget_mb=args.memory_budget_mb, photo_encode=args.photo_encode, **common)
+
+
+def run_watch(args, progress, control):
+    """监视模式：照片进程池在多次处理之间保持，工作进程中的字体和水印图片缓存一直有效；跳过的文件不输出进度"""
+    def report(status, input_path, output_path):
+        if status != 'skipped':
+            progress(status, input_path, output_path)
+
+    # 已处理的文件沿用原来的输出名称，新文件编号接在已有编号之后，后来的文件排序靠前也不会改动已有的输出
+    extra = {'append_numbers': True}
+    pool = None
+    if args.mode != 'compress' and (args.max_workers or os.cpu_count() or 1) > 1:
+        pool = ProcessPoolExecutor(max_workers=args.max_workers or os.cpu_count(), initializer=ignore_interrupt)
+        extra['executor'] = pool
+    def log_message(message, color='gray'):
+        print(message, file=sys.stderr, flush=True)
+
+    log_func = None if args.quiet else log_message
+    # 压缩模式会处理目录中的所有文件
+    is_target = is_watermark_target if args.mode != 'compress' else (lambda name: True)
+    try:
+        watch_directory(args.root_dir, lambda file_filter: run(args, report, control, file_filter=file_filter, **extra),
+                        is_target, args.settle, args.poll_interval, control, log_func)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+
+def run_benchmark(args):
+    """每个配置输出一行 JSON 结果，有配置编码失败时返回 1"""
+    with contextlib.redirect_stdout(sys.stderr):
+        results = benchmark_video_profiles(args.sample, args.profiles, args.quality, args.threads)
+    for result in results:
+        print(json.dumps(dict(result, event='benchmark'), ensure_ascii=False), flush=True)
+    return 0 if all(result['success'] for result in results) else 1
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.mode == 'bench-video':
+        if not os.path.isfile(args.sample):
+            parser.error(f"样例视频不存在: {args.sample}")
+        return run_benchmark(args)
+    if not os.path.isdir(args.root_dir):
+        parser.error(f"源目录不存在: {args.root_dir}")
+    if args.out_path is not None and os.path.abspath(args.out_path) == os.path.abspath(args.root_dir):
+        parser.error("导出与导入目录不能一致")
+    if args.mode == 'text' and not is_color(args.text_color_hex):
+        parser.error("字体颜色不合法")
+    if args.mode == 'image' and not is_valid_watermark_image(args.watermark_image_path):
+        parser.error("水印图片路径为空或者图片有误")
+    if args.mode == 'compress' and args.target_kb is not None and args.target_kb < 1:
+        parser.error("目标大小必须大于 0")
+    if args.watch:
+        root = os.path.abspath(args.root_dir)
+        out_root = os.path.abspath(args.out_path if args.out_path is not None else f"{args.root_dir}_out")
+        if os.path.commonpath([root, out_root]) == root:
+            parser.error("监视模式下输出目录不能位于源目录内")
+        args.incremental = True
+    if args.mode != 'compress':
+        try:
+            args.photo_encode = photo_encode_from_args(args)
+        except ValueError as e:
+            parser.error(str(e))
+
+    # 监视模式下每次处理都会重新遍历目录，不统计总数
+    tracker = None if args.watch else ProgressTracker()
+    progress = ProgressReporter(sys.stdout, tracker)
+    control = RunControl()
+
+    def cancel(signum, frame):
+        # 第一次取消等待收尾，再次按下时恢复默认行为立即退出
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        print("正在取消...", file=sys.stderr, flush=True)
+        control.cancel()
+
+    signal.signal(signal.SIGINT, cancel)
+    signal.signal(signal.SIGTERM, cancel)
+    # 核心模块的错误信息写到标准错误；其余 print 输出（如第三方库）也转到标准错误，标准输出只保留 JSON 进度
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.watch:
+            run_watch(args, progress, control)
+        else:
+            run(args, progress, control, tracker)
+    progress.summary(control)
+    # 监视模式只能通过取消停止，属于正常退出
+    if control.cancelled and not args.watch:
+        return 130
+    return 1 if progress.counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
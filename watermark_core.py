@@ -0,0 +1,2979 @@
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import os
+import re
+import select
+import shlex
+import signal
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
+
+import pytz
+from PIL import Image, ImageDraw, ImageFont, ImageOps, JpegImagePlugin
+from PIL.ExifTags import TAGS
+import subprocess
+import logging
+import shutil
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def resource_path(relative_path):
+    try:
+        base_path = sys._MEIPASS
+    except Exception:
+        base_path = os.path.abspath(".")
+    return os.path.join(base_path, relative_path)
+
+
+# 当前线程正在统计的任务指标，只有通过 _timed_job 执行的任务才会统计
+_job_local = threading.local()
+
+
+@contextlib.contextmanager
+def timed_stage(name):
+    """
+    统计当前任务某个阶段（decode、exif、draw、encode、probe、copy 等）的耗时，同名阶段累加；未统计时不做任何事
+    """
+    stages = getattr(_job_local, 'stages', None)
+    if stages is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def record_job_info(**info):
+    """记录当前任务的附加信息，如照片像素数 pixels、视频时长 duration"""
+    job_info = getattr(_job_local, 'info', None)
+    if job_info is not None:
+        job_info.update(info)
+
+
+class JobResult:
+    """带指标的任务结果，真值与是否成功一致，可以跨进程传递"""
+    __slots__ = ('success', 'metrics')
+
+    def __init__(self, success, metrics):
+        self.success = success
+        self.metrics = metrics
+
+    def __bool__(self):
+        return bool(self.success)
+
+
+def _timed_job(input_path, output_path, func, *args, **kwargs):
+    """
+    执行处理函数 func(input_path, output_path, *args, **kwargs) 并统计总耗时、各阶段耗时和工作进程/线程
+    :return: JobResult
+    """
+    _job_local.stages = {}
+    _job_local.info = {}
+    start = time.perf_counter()
+    try:
+        success = func(input_path, output_path, *args, **kwargs)
+    finally:
+        stages, info = _job_local.stages, _job_local.info
+        _job_local.stages = _job_local.info = None
+    metrics = {
+        'seconds': round(time.perf_counter() - start, 6),
+        'stages': {name: round(seconds, 6) for name, seconds in stages.items()},
+        'worker': f"{os.getpid()}/{threading.current_thread().name}",
+    }
+    metrics.update(info)
+    return JobResult(success, metrics)
+
+
+def get_image_capture_time(image, out_date_format=0):
+    """
+    从已打开的图像中读取拍摄时间，不会再次打开文件
+    :param image: 已打开的图像
+    :param out_date_format: 输出时间格式；0=2025年1月1日；1=2025-01-01；2=2025/1/1
+    :return: 时间
+    """
+    try:
+        exif_data = image.getexif()
+        if exif_data:
+            for tag_id, value in exif_data.items():
+                tag = TAGS.get(tag_id, tag_id)
+                if tag == "DateTime":
+                    date_format = "%Y:%m:%d %H:%M:%S"
+                    date_time_obj = datetime.strptime(value, date_format)
+                    if out_date_format == 1:
+                        formatted = r"%Y-%m-%d"
+                    elif out_date_format == 2:
+                        formatted = r"%Y/%m/%d"
+                    else:
+                        formatted = r"%Y年%m月%d日"
+                    formatted_date_str = date_time_obj.strftime(formatted)
+                    return formatted_date_str
+    except Exception as e:
+        print(f"无法读取照片信息：{e}", file=sys.stderr)
+    return None
+
+
+def get_photo_capture_time(image_path, out_date_format=0):
+    try:
+        with Image.open(image_path) as image:
+            return get_image_capture_time(image, out_date_format)
+    except Exception as e:
+        print(f"无法读取照片信息：{e}", file=sys.stderr)
+    return None
+
+
+def is_color(color_str):
+    try:
+        if color_str is None or not isinstance(color_str, str):
+            return False
+        # 去除 '#' 和 '0x' 前缀
+        cleaned = color_str.lstrip('#').lstrip('0x')
+        # 检查是否只包含16进制字符
+        if not all(c in "0123456789abcdefABCDEF" for c in cleaned):
+            return False
+
+        # 确保长度符合要求（6位RGB或8位RGBA）
+        if len(cleaned) == 6 or len(cleaned) == 8:
+            return True
+        else:
+            return False
+    except Exception as e:
+        print(f"err:{e}", file=sys.stderr)
+        return False
+
+
+def convert_color_to_numeric(color_str):
+    """
+    将颜色字符串转换为纯数字表示。
+    支持的格式包括：233D9E64、3D9E64、#3D9E64、#233D9E64、0x233D9E64、0x3D9E64
+    如果输入无效，则返回白色 (#FFFFFFFF) 的数值表示。
+    """
+    try:
+        if color_str is None or not isinstance(color_str, str):
+            return "FFFFFFFF"
+        # 去除 '#' 和 '0x' 前缀
+        cleaned = color_str.lstrip('#').lstrip('0x')
+
+        # 检查是否只包含16进制字符
+        if not all(c in "0123456789abcdefABCDEF" for c in cleaned):
+            raise ValueError("Invalid character found in color string.")
+
+        # 确保长度符合要求（6位RGB或8位RGBA）
+        if len(cleaned) == 6 or len(cleaned) == 8:
+            return cleaned
+        else:
+            raise ValueError("Color string must be either 6 (for RGB) or 8 (for RGBA) hexadecimal digits long.")
+    except Exception as e:
+        print(f"Error with '{color_str}': {e}", file=sys.stderr)
+        # 返回白色 (#FFFFFFFF) 的数值表示
+        return "FFFFFFFF"
+
+
+def bucket_font_size(size):
+    """
+    字号分档：相近分辨率照片计算出的字号归到同一档，从而共用同一个字体对象，字号误差不超过约 6%
+    :param size: 按照片尺寸计算出的字号
+    :return: 分档后的字号
+    """
+    step = max(size // 16, 1)
+    return size - size % step
+
+
+def caption_font_size(image_size, font_size=40):
+    """
+    按照片短边计算文字水印实际使用的字号（已分档），font_size 为 40 时字号为短边的 1/24
+    :param image_size: 照片或视频画面的 (宽, 高)
+    :param font_size: 界面上设置的字体大小
+    """
+    size = max(int(min(image_size) / 24 * font_size / 40), 6)
+    return bucket_font_size(size)
+
+
+@functools.lru_cache(maxsize=32)
+def load_font(font_type, size):
+    """
+    加载字体并在当前进程内缓存，避免每张照片都重新解析 simsun.ttc、msyh.ttc 等较大的字体文件
+    :param font_type: 字体文件
+    :param size: 字号
+    :return: 字体对象
+    """
+    return ImageFont.truetype(font_type, size)
+
+
+def render_text_caption(image_size, watermark_text, font_size=40, txt_position=0, txt_padding=20, h_padding=40,
+                        bg_alpha=0, text_color_hex="FFFFFF", font_type='simsun.ttc'):
+    """
+    按照片文字水印的排版，只绘制水印所在区域的透明图层；照片和视频共用，保证两者的水印外观一致
+    :param image_size: 照片或视频画面的 (宽, 高)
+    其他参数含义同 add_text_watermark2
+    :return: (水印 RGBA 图层, 图层左上角在画面中的位置)；水印完全在画面外时返回 (None, None)
+    """
+    width, height = image_size
+    font = load_font(font_type, caption_font_size(image_size, font_size))  # 根据图像短边设置字体大小
+    measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    bbox = measure.textbbox((0, 0), watermark_text, font=font)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+    padding = int(text_height * txt_padding / 40)
+    h_padding = int(text_height * h_padding / 40)
+    if watermark_text.find("\n") != -1:
+        h_padding = int(h_padding / 2)
+        padding = int(text_height * txt_padding / 80)
+    position = (padding, height - text_height - h_padding)
+    if txt_position == 0:
+        position = (padding, height - text_height - h_padding)
+    elif txt_position == 1:
+        position = (width - text_width - padding, height - text_height - h_padding)
+    elif txt_position == 2:
+        position = (padding, h_padding)
+    elif txt_position == 3:
+        position = (width - text_width - padding, h_padding)
+    bg_color = (0, 0, 0, bg_alpha)
+    bg_position = (
+        position[0] - 12, position[1] - 12, position[0] + text_width + 12, position[1] + text_height + 20)
+    text_color = "#" + text_color_hex
+    # 水印区域：背景框与文字外框的并集，多留 2 像素防止抗锯齿边缘被裁掉
+    text_box = measure.textbbox(position, watermark_text, font=font)
+    left = max(min(bg_position[0], text_box[0]) - 2, 0)
+    top = max(min(bg_position[1], text_box[1]) - 2, 0)
+    right = min(max(bg_position[2] + 1, text_box[2]) + 2, width)
+    bottom = min(max(bg_position[3] + 1, text_box[3]) + 2, height)
+    if right <= left or bottom <= top:
+        return None, None
+    watermark = Image.new("RGBA", (right - left, bottom - top), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(watermark)
+    draw.rectangle((bg_position[0] - left, bg_position[1] - top, bg_position[2] - left, bg_position[3] - top),
+                   fill=bg_color)
+    draw.text((position[0] - left, position[1] - top), watermark_text, font=font, fill=text_color)
+    return watermark, (left, top)
+
+
+def render_text_watermark(image, watermark_text, font_size=40, txt_position=0, txt_padding=20, h_padding=40,
+                          bg_alpha=0, text_color_hex="FFFFFF", font_type='simsun.ttc'):
+    """
+    在已打开的图像上绘制文字水印，参数含义同 add_text_watermark2
+    只对文字及背景框所在区域做透明叠加，临时内存与计算量只和水印大小有关，结果与整幅叠加逐字节一致
+    :return: 添加水印后的 RGB 图像
+    """
+    watermark, position = render_text_caption(image.size, watermark_text, font_size, txt_position, txt_padding,
+                                              h_padding, bg_alpha, text_color_hex, font_type)
+    if image.mode in ("RGB", "RGBA"):
+        combined = image.convert("RGB")
+    else:
+        combined = image.convert("RGBA").convert("RGB")
+    if watermark is not None:
+        left, top = position
+        region = image.crop((left, top, left + watermark.width, top + watermark.height)).convert("RGBA")
+        region = Image.alpha_composite(region, watermark).convert("RGB")
+        combined.paste(region, position)
+    return combined
+
+
+PHOTO_SUBSAMPLING = ('keep', '4:4:4', '4:2:2', '4:2:0')
+
+
+def photo_encode_options(quality=85, optimize=True, progressive=True, subsampling='keep', keep_metadata=True):
+    """
+    照片输出编码参数，传给 process_directory(photo_encode=...) 和各加水印函数
+    :param quality: JPEG/WEBP 质量 1-95；Pillow 默认为 75，85 时肉眼基本看不出差别
+    :param optimize: JPEG 计算最优霍夫曼表，PNG 使用最高压缩，文件更小、画质不变
+    :param progressive: JPEG 渐进式输出，通常比基线 JPEG 小几个百分点
+    :param subsampling: JPEG 色度抽样；keep（默认）沿用源 JPEG 的抽样方式，非 JPEG 源使用 Pillow 默认的 4:2:0
+    :param keep_metadata: 保留源文件的 EXIF（拍摄时间、GPS、相机参数等）和 ICC 色彩配置
+    """
+    if not 1 <= quality <= 95:
+        raise ValueError(f"quality 应在 1-95 之间: {quality}")
+    if subsampling not in PHOTO_SUBSAMPLING:
+        raise ValueError(f"未知的色度抽样: {subsampling}，可选 {', '.join(PHOTO_SUBSAMPLING)}")
+    return {'quality': quality, 'optimize': optimize, 'progressive': progressive, 'subsampling': subsampling,
+            'keep_metadata': keep_metadata}
+
+
+def read_photo_metadata(image):
+    """
+    在源文件打开期间读取写出时需要透传的信息：EXIF 原始数据、ICC 色彩配置和 JPEG 色度抽样
+    :param image: 已打开的源图像
+    :return: dict，没有的项不包含
+    """
+    metadata = {}
+    exif = image.info.get('exif')
+    if not exif:
+        exif_data = image.getexif()
+        if len(exif_data):
+            exif = exif_data.tobytes()
+    if exif:
+        metadata['exif'] = exif
+    icc_profile = image.info.get('icc_profile')
+    if icc_profile:
+        metadata['icc_profile'] = icc_profile
+    if image.format == 'JPEG':
+        sampling = JpegImagePlugin.get_sampling(image)
+        if sampling != -1:
+            metadata['subsampling'] = sampling
+    return metadata
+
+
+# EXIF 方向标记：1 为正常，2-8 为查看器显示前需要的翻转/旋转
+EXIF_ORIENTATION = 0x0112
+
+
+def _reset_exif_orientation(exif):
+    """
+    把 EXIF 原始数据 IFD0 中的方向标记原地改为 1，其余字节（包括厂商私有数据）不变
+    :param exif: EXIF 原始数据，可以带 "Exif\0\0" 前缀
+    :return: 修改后的数据；无法解析时原样返回
+    """
+    offset = 6 if exif.startswith(b'Exif\x00\x00') else 0
+    byte_order = exif[offset:offset + 2]
+    if byte_order not in (b'II', b'MM'):
+        return exif
+    endian = '<' if byte_order == b'II' else '>'
+    try:
+        ifd = offset + struct.unpack_from(endian + 'I', exif, offset + 4)[0]
+        count = struct.unpack_from(endian + 'H', exif, ifd)[0]
+        for index in range(count):
+            entry = ifd + 2 + index * 12
+            tag, tag_type = struct.unpack_from(endian + 'HH', exif, entry)
+            if tag == EXIF_ORIENTATION and tag_type == 3:
+                data = bytearray(exif)
+                struct.pack_into(endian + 'H', data, entry + 8, 1)
+                return bytes(data)
+    except struct.error:
+        pass
+    return exif
+
+
+def upright_photo(image, metadata):
+    """
+    按 EXIF 方向标记把照片转正，水印绘制在查看时的方向上；透传的 EXIF 中方向标记同时改为 1，
+    否则查看器会把转正后的照片再旋转一次，水印随之转到侧面
+    :param image: 已解码的源图像
+    :param metadata: read_photo_metadata 的结果，其中的 EXIF 会被修改
+    :return: 转正后的图像，没有方向标记时返回原图像
+    """
+    if image.getexif().get(EXIF_ORIENTATION, 1) not in range(2, 9):
+        return image
+    if metadata and 'exif' in metadata:
+        metadata['exif'] = _reset_exif_orientation(metadata['exif'])
+    return ImageOps.exif_transpose(image)
+
+
+def save_photo(image, output_image_path, metadata=None, encode_options=None, image_format=None):
+    """
+    按输出扩展名的格式写出照片
+    :param image: 要保存的图像
+    :param output_image_path: 输出路径，也可以是 BytesIO 等文件对象（需指定 image_format）
+    :param metadata: read_photo_metadata 的结果
+    :param encode_options: photo_encode_options 的结果；为 None 时使用 Pillow 默认参数且不保留元数据（原来的行为）
+    :param image_format: 输出格式，如 'JPEG'；None 表示按输出路径的扩展名确定
+    """
+    if encode_options is None:
+        image.save(output_image_path, image_format)
+        return
+    if image_format is None:
+        image_format = Image.registered_extensions().get(os.path.splitext(output_image_path)[1].lower())
+    metadata = metadata or {}
+    params = {}
+    if encode_options.get('keep_metadata', True):
+        for key in ('exif', 'icc_profile'):
+            if key in metadata:
+                params[key] = metadata[key]
+    if image_format == 'JPEG':
+        params.update(quality=encode_options.get('quality', 85), optimize=encode_options.get('optimize', True),
+                      progressive=encode_options.get('progressive', True))
+        subsampling = encode_options.get('subsampling', 'keep')
+        if subsampling == 'keep':
+            subsampling = metadata.get('subsampling')
+        if subsampling is not None:
+            params['subsampling'] = subsampling
+    elif image_format == 'WEBP':
+        params['quality'] = encode_options.get('quality', 85)
+        if encode_options.get('optimize', True):
+            params['method'] = 6
+    elif image_format == 'PNG':
+        params['optimize'] = encode_options.get('optimize', True)
+    image.save(output_image_path, image_format, **params)
+
+
+def add_text_watermark2(input_image_path, output_image_path, watermark_text, font_size=40, txt_position=0,
+                        txt_padding=20, h_padding=40, bg_alpha=0, text_color_hex="FFFFFF", font_type='simsun.ttc',
+                        encode_options=None):
+    try:
+        with Image.open(input_image_path) as image:
+            metadata = read_photo_metadata(image) if encode_options is not None else None
+            with timed_stage('decode'):
+                image.load()
+                if encode_options is not None:
+                    image = upright_photo(image, metadata)
+            record_job_info(pixels=image.width * image.height)
+            with timed_stage('draw'):
+                combined = render_text_watermark(image, watermark_text, font_size, txt_position, txt_padding,
+                                                 h_padding, bg_alpha, text_color_hex, font_type)
+        with timed_stage('encode'):
+            save_photo(combined, output_image_path, metadata, encode_options)
+        return True
+    except Exception as e:
+        print(f"err:{e}", file=sys.stderr)
+        return False
+
+
+def add_text_watermark_with_date(input_image_path, output_image_path, watermark_text, out_date_format=0, font_size=40,
+                                 txt_position=0, txt_padding=20, h_padding=40, bg_alpha=0, text_color_hex="FFFFFF",
+                                 font_type='simsun.ttc', encode_options=None):
+    """
+    只打开一次照片：从同一个文件句柄读取拍摄时间并绘制水印，读取到拍摄时间时将其加在水印文字前一行
+    :param out_date_format: 输出时间格式；0=2025年1月1日；1=2025-01-01；2=2025/1/1
+    :param encode_options: 输出编码参数，见 photo_encode_options；为 None 时使用 Pillow 默认参数
+    其余参数同 add_text_watermark2
+    """
+    try:
+        with Image.open(input_image_path) as image:
+            with timed_stage('exif'):
+                create_date = get_image_capture_time(image, out_date_format)
+                metadata = read_photo_metadata(image) if encode_options is not None else None
+            if create_date:
+                watermark_text = f"{create_date}\n{watermark_text}"
+            with timed_stage('decode'):
+                image.load()
+                if encode_options is not None:
+                    image = upright_photo(image, metadata)
+            record_job_info(pixels=image.width * image.height)
+            with timed_stage('draw'):
+                combined = render_text_watermark(image, watermark_text, font_size, txt_position, txt_padding,
+                                                 h_padding, bg_alpha, text_color_hex, font_type)
+        with timed_stage('encode'):
+            save_photo(combined, output_image_path, metadata, encode_options)
+        return True
+    except Exception as e:
+        print(f"err:{e}", file=sys.stderr)
+        return False
+
+
+def get_ffmpeg_tool_path(name):
+    """
+    获取 ffmpeg/ffprobe 的路径：打包后使用内置版本，开发环境使用本机目录，都不存在时（如无界面的服务器）从 PATH 中查找
+    :param name: 'ffmpeg' 或 'ffprobe'
+    """
+    if getattr(sys, 'frozen', False):
+        ffmpeg_dir = resource_path('ffmpeg')
+        return os.path.join(ffmpeg_dir, 'bin', f'{name}.exe')
+    dev_path = rf"F:\ffmpeg-master-latest-win64-gpl-shared\bin\{name}.exe"
+    if os.path.exists(dev_path):
+        return dev_path
+    return shutil.which(name) or name
+
+
+def run_ffmpeg_command(command_str):
+    """
+    执行 ffmpeg 命令字符串：Windows 下直接交给 CreateProcess 并隐藏 CMD 窗口，其他系统按 shell 规则拆分为参数列表
+    :return: subprocess.CompletedProcess
+    """
+    startupinfo = None
+    if hasattr(subprocess, 'STARTUPINFO'):
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    args = command_str if os.name == 'nt' else shlex.split(command_str)
+    control = getattr(_job_local, 'control', None)
+    with timed_stage('ffmpeg'):
+        if control is None:
+            result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo=startupinfo)
+        else:
+            # 受 RunControl 控制：暂停时不启动新的 ffmpeg，取消时不再启动并终止正在运行的进程
+            if control.wait_if_paused():
+                return subprocess.CompletedProcess(args, -1, b'', b'cancelled')
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo=startupinfo)
+            control.register(process)
+            try:
+                stdout, stderr = process.communicate()
+            finally:
+                control.unregister(process)
+            result = subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+    _record_ffmpeg_duration(result.stderr)
+    return result
+
+
+# ffmpeg 输出信息中第一个输入文件的时长，如 "Duration: 00:01:02.50"
+FFMPEG_DURATION_PATTERN = re.compile(rb'Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)')
+
+
+def _record_ffmpeg_duration(stderr):
+    """统计指标且本任务没有用 ffprobe 读取时长时，从 ffmpeg 的输出信息中取源视频时长，不需要再运行 ffprobe"""
+    job_info = getattr(_job_local, 'info', None)
+    if job_info is None or 'duration' in job_info or not stderr:
+        return
+    match = FFMPEG_DURATION_PATTERN.search(stderr)
+    if match:
+        hours, minutes, seconds = match.groups()
+        job_info['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def _record_copied_video_duration(video_path):
+    """直接复制的视频不经过 ffmpeg，统计指标时用 ffprobe 读取时长；未统计指标或没有 ffprobe 时不读取"""
+    if getattr(_job_local, 'info', None) is None:
+        return
+    ffprobe_path = get_ffmpeg_tool_path('ffprobe')
+    if os.path.exists(ffprobe_path) or shutil.which(ffprobe_path):
+        probe_video(video_path)
+
+
+@dataclass
+class VideoInfo:
+    """
+    ffprobe 读取的视频信息
+    width/height 为编码尺寸，rotation 为显示时的旋转角度，display_width/display_height 为旋转后的实际显示尺寸
+    """
+    width: int = 0
+    height: int = 0
+    rotation: int = 0
+    duration: float = 0.0
+    codec: str = None
+    audio_codec: str = None
+    format_name: str = None
+    creation_time: str = None
+    frame_rate: float = 0.0
+    frames: int = 0
+
+    @property
+    def display_width(self):
+        return self.height if self.rotation % 180 == 90 else self.width
+
+    @property
+    def display_height(self):
+        return self.width if self.rotation % 180 == 90 else self.height
+
+
+def probe_video(video_path):
+    """
+    只调用一次 ffprobe，以 JSON 格式读取视频的尺寸、旋转角度、时长、编码和拍摄时间
+    :param video_path: 视频的路径
+    :return: VideoInfo，读取失败返回 None
+    """
+    try:
+        command = [
+            get_ffmpeg_tool_path('ffprobe'),
+            '-v', 'quiet',
+            '-print_format', 'json',
+            '-show_format',
+            '-show_streams',
+            video_path
+        ]
+        startupinfo = None
+        if hasattr(subprocess, 'STARTUPINFO'):
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        with timed_stage('probe'):
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                    encoding='utf-8', startupinfo=startupinfo)
+        if result.returncode != 0:
+            logging.error(f"错误信息：{result.stderr}")
+            return None
+        data = json.loads(result.stdout or '{}')
+        streams = data.get('streams', [])
+        fmt = data.get('format', {})
+        # 按流类型查找，不依赖视频流的序号
+        video = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+        audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), None)
+        if video is None:
+            return None
+        tags = video.get('tags', {})
+        rotation = tags.get('rotate')
+        if rotation is None:
+            for side_data in video.get('side_data_list', []):
+                if 'rotation' in side_data:
+                    rotation = side_data['rotation']
+                    break
+        duration = video.get('duration') or fmt.get('duration') or 0
+        frame_rate = 0.0
+        num, _, den = str(video.get('avg_frame_rate') or video.get('r_frame_rate') or '0/1').partition('/')
+        if float(den or 1):
+            frame_rate = float(num) / float(den or 1)
+        frames = int(video.get('nb_frames') or 0) or int(float(duration) * frame_rate)
+        record_job_info(duration=float(duration))
+        return VideoInfo(
+            width=int(video.get('width', 0)),
+            height=int(video.get('height', 0)),
+            rotation=int(float(rotation or 0)) % 360,
+            duration=float(duration),
+            codec=video.get('codec_name'),
+            audio_codec=audio.get('codec_name') if audio else None,
+            format_name=fmt.get('format_name'),
+            creation_time=tags.get('creation_time') or fmt.get('tags', {}).get('creation_time'),
+            frame_rate=frame_rate,
+            frames=frames,
+        )
+    except Exception as e:
+        logging.error(f"详细错误信息：{str(e)}")
+        return None
+
+
+def get_video_creation_date(video_path, out_date_format=0, video_info=None):
+    """
+    获取视频的拍摄时间
+    :param video_path:视频的路径
+    :param out_date_format: 输出时间格式；0=2025年1月1日；1=2025-01-01；2=2025/1/1
+    :param video_info: 已读取的视频信息，为 None 时调用 ffprobe 读取
+    :return: 时间
+    """
+    try:
+        if video_info is None:
+            video_info = probe_video(video_path)
+        if video_info is None or not video_info.creation_time:
+            return None
+        creation_time_str = video_info.creation_time.strip()
+        if '.' in creation_time_str:
+            creation_time_utc = datetime.strptime(creation_time_str, '%Y-%m-%dT%H:%M:%S.%fZ')
+        else:
+            creation_time_utc = datetime.strptime(creation_time_str, '%Y-%m-%dT%H:%M:%SZ')
+        utc_timezone = pytz.timezone('UTC')
+        creation_time_utc = utc_timezone.localize(creation_time_utc)
+        china_timezone = pytz.timezone('Asia/Shanghai')
+        creation_time_cst = creation_time_utc.astimezone(china_timezone)
+        if out_date_format == 1:
+            formatted = r"%Y-%m-%d"
+        elif out_date_format == 2:
+            formatted = r"%Y/%m/%d"
+        else:
+            formatted = r"%Y年%m月%d日"
+        creation_date_cst = creation_time_cst.strftime(formatted)
+        return creation_date_cst
+    except Exception as e:
+        logging.error(f"详细错误信息：{str(e)}")
+        return None
+
+
+# 不处理的视频直接复制到输出目录时可选的方式：
+# copy=普通复制；fast=先尝试写时复制（reflink），再由内核完成复制（copy_file_range/sendfile），最后才用缓冲区复制；
+# link=先尝试硬链接（输出与源文件共用同一份数据，修改其中一个会影响另一个），失败后同 fast
+PASSTHROUGH_MODES = ('copy', 'fast', 'link')
+_FICLONE = 0x40049409
+
+
+def _reflink_file(src_file, dst_file):
+    """写时复制：Btrfs、XFS 等文件系统上只复制元数据，不支持时抛出 OSError"""
+    import fcntl
+    fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+
+
+def _kernel_copy_file(src_file, dst_file, size):
+    """由内核在文件之间直接复制数据，不经过用户态缓冲区；系统不支持时抛出 OSError 或 AttributeError"""
+    src_fd, dst_fd = src_file.fileno(), dst_file.fileno()
+    offset = 0
+    while offset < size:
+        if hasattr(os, 'copy_file_range'):
+            sent = os.copy_file_range(src_fd, dst_fd, size - offset, offset, offset)
+        else:
+            sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+        if sent == 0:
+            raise OSError(f"内核复制不完整: {offset}/{size}")
+        offset += sent
+
+
+def passthrough_copy(src_path, dst_path, mode='fast'):
+    """
+    把源文件原样复制到输出路径，按 mode 依次尝试更快的方式
+    :param mode: copy、fast 或 link，见 PASSTHROUGH_MODES
+    :return: 实际使用的方式：hardlink、reflink、kernel 或 buffered
+    """
+    if mode == 'link':
+        try:
+            if os.path.exists(dst_path):
+                os.remove(dst_path)
+            os.link(src_path, dst_path)
+            return 'hardlink'
+        except OSError:
+            pass
+    if mode in ('fast', 'link'):
+        size = os.path.getsize(src_path)
+        with open(src_path, 'rb') as src_file, open(dst_path, 'wb') as dst_file:
+            for method, copy_func in (('reflink', lambda: _reflink_file(src_file, dst_file)),
+                                      ('kernel', lambda: _kernel_copy_file(src_file, dst_file, size))):
+                try:
+                    copy_func()
+                    shutil.copymode(src_path, dst_path)
+                    return method
+                except (OSError, AttributeError, ImportError):
+                    dst_file.seek(0)
+                    dst_file.truncate()
+    shutil.copy(src_path, dst_path)
+    return 'buffered'
+
+
+def copy_video_and_rename(src_path, dst_path, passthrough='copy'):
+    """
+    不处理的视频直接复制到输出路径
+    :param passthrough: 复制方式，见 PASSTHROUGH_MODES；copy 与原来一样使用 shutil.copy
+    """
+    try:
+        with timed_stage('copy'):
+            if passthrough == 'copy':
+                shutil.copy(src_path, dst_path)
+            else:
+                method = passthrough_copy(src_path, dst_path, passthrough)
+                logging.debug(f"复制 {src_path} 方式: {method}")
+        _record_copied_video_duration(src_path)
+        return True
+    except Exception as e:
+        print(f"发生了一个错误: {e}", file=sys.stderr)
+        return False
+
+
+def get_video_dimensions(video_path, video_info=None):
+    """
+    获取视频旋转后的显示尺寸
+    :param video_path: 视频的路径
+    :param video_info: 已读取的视频信息，为 None 时调用 ffprobe 读取
+    :return: (宽, 高)，读取失败返回默认值 720x1280
+    """
+    default_width = 720
+    default_height = 1280
+    if video_info is None:
+        video_info = probe_video(video_path)
+    if video_info is not None and video_info.width > 0 and video_info.height > 0:
+        return video_info.display_width, video_info.display_height
+    print(f"警告: 获取视频尺寸失败: {video_path}", file=sys.stderr)
+    return default_width, default_height
+
+
+def add_watermark_ffmpeg(src_path, dst_path, watermark_text, font_size=40, txt_position=0, padding=20, h_padding=40,
+                         text_color_hex=None, font_type='simsun.ttc', watermark_type='text', watermark_image_path=None,
+                         watermark_width=0, watermark_height=0, threads=0, video_info=None, text_mode='overlay'):
+    """
+    使用 ffmpeg 给单个视频添加水印
+    :param text_mode: 文字水印方式；overlay=用照片水印的排版预先绘制一张透明 PNG 再叠加到每一帧，
+                      drawtext=由 ffmpeg 逐帧排版绘制（依赖 C:/Windows/Fonts 下的字体）
+    其他参数含义同 process_directory
+    :return: 是否成功
+    """
+    caption_path = None
+    try:
+        ffmpeg_path = get_ffmpeg_tool_path('ffmpeg')
+        if not os.path.exists(ffmpeg_path):
+            return False
+        x = f'{padding}'
+        # 限制单个编码任务的线程数，多个任务并发时总线程数不超过 CPU 核数
+        threads_arg = f'-threads {threads} ' if threads > 0 else ''
+        if watermark_type == 'text' and text_mode == 'overlay':
+            # 文字只排版绘制一次，ffmpeg 只做叠加；文字不出现在命令行中，无需转义引号和冒号
+            video_width, video_height = get_video_dimensions(src_path, video_info)
+            with timed_stage('draw'):
+                caption, position = render_text_caption((video_width, video_height), watermark_text, font_size,
+                                                        txt_position, padding, h_padding, 0,
+                                                        convert_color_to_numeric(text_color_hex), font_type)
+                if caption is not None:
+                    fd, caption_path = tempfile.mkstemp(suffix='.png', prefix='wm_caption_')
+                    os.close(fd)
+                    caption.save(caption_path)
+            if caption is None:
+                return copy_video_and_rename(src_path, dst_path)
+            command_str = rf'{ffmpeg_path} -y -i "{src_path}" -i "{caption_path}" -filter_complex "[0:v][1:v]overlay={position[0]}:{position[1]}" -c:a copy {threads_arg}"{dst_path}"'
+        elif watermark_type == 'text':
+            h_padding = int(h_padding * 0.7)
+            font_path = rf'C:/Windows/Fonts/{font_type}'
+            if not os.path.exists(font_path):
+                return False
+            y = f'(h - text_h)-{h_padding}'
+            if txt_position == 0:
+                x = f'{padding}'
+                y = f'(h - text_h)-{h_padding}'
+            elif txt_position == 1:
+                x = f'(w - text_w)-{padding}'
+                y = f'(h - text_h)-{h_padding}'
+            elif txt_position == 2:
+                x = f'{padding}'
+                y = f'{padding}'
+            elif txt_position == 3:
+                x = f'(w - text_w)-{padding}'
+                y = f'{h_padding}'
+            text_color = convert_color_to_numeric(text_color_hex)
+            command_str = rf'{ffmpeg_path} -y -i "{src_path}" -vf "drawtext=fontfile=\'{font_path}\':text=\'{watermark_text}\':fontsize={int(font_size * 0.8)}:fontcolor={text_color}:box=1:boxcolor=black@0:boxborderw=5:x={x}:y={y}" -c:a copy {threads_arg}"{dst_path}"'
+        else:
+            watermark = Image.open(watermark_image_path).convert("RGBA")
+            wm_width, wm_height = watermark.size
+            video_width, video_height = get_video_dimensions(src_path, video_info)
+            print(f"video_width:{video_width};video_height:{video_height}", file=sys.stderr)
+            if watermark_width > 0 and watermark_height > 0:
+                w_width = watermark_width
+                w_height = watermark_height
+            elif watermark_width == 0 and watermark_height > 0:
+                w_width = int(wm_width / wm_height * watermark_height)
+                w_height = watermark_height
+            elif watermark_width > 0 and watermark_height == 0:
+                w_width = wm_width
+                w_height = int(watermark_width / wm_width * wm_height)
+            else:
+                w_width = int(wm_width * 0.4)
+                w_height = int(wm_height * 0.4)
+            y = video_height - w_height - h_padding
+            if txt_position == 0:
+                x = padding
+                y = video_height - w_height - h_padding
+            elif txt_position == 1:
+                x = video_width - w_width - padding
+                y = video_height - w_height - h_padding
+            elif txt_position == 2:
+                x = padding
+                y = h_padding
+            elif txt_position == 3:
+                x = video_width - w_width - padding
+                y = h_padding
+            command_str = rf'{ffmpeg_path} -y -i "{src_path}" -i "{watermark_image_path}"  -filter_complex  "[1:v]scale={w_width}:{w_height}[wm];[0:v][wm]overlay={x}:{y}" -c:a copy {threads_arg}"{dst_path}"'
+        print(command_str, file=sys.stderr)
+        result = run_ffmpeg_command(command_str)
+        if result.returncode == 0:
+            print(f"视频处理成功：{src_path} -> {dst_path}", file=sys.stderr)
+            return True
+        else:
+            return False
+    except subprocess.CalledProcessError as e:
+        logging.error(f"FFmpeg 错误信息：{e.stderr.decode()}")
+        return False
+    except Exception as e:
+        logging.error(f"FFmpeg {src_path} 错误信息： {str(e)}")
+        return False
+    finally:
+        if caption_path is not None and os.path.exists(caption_path):
+            os.remove(caption_path)
+
+
+def get_watermark_size(wm_size, base_size, watermark_width=0, watermark_height=0):
+    """
+    计算图片水印缩放后的尺寸
+    :param wm_size: 水印图片原始尺寸
+    :param base_size: 照片尺寸
+    :param watermark_width: 指定的水印宽度，0 表示按高度等比例计算
+    :param watermark_height: 指定的水印高度，0 表示按宽度等比例计算
+    :return: 水印尺寸
+    """
+    wm_width, wm_height = wm_size
+    width, height = base_size
+    if watermark_width > 0 and watermark_height > 0 and wm_width < width and wm_height < height:
+        return watermark_width, watermark_height
+    elif watermark_width == 0 and watermark_height > 0:
+        return int(wm_width / wm_height * watermark_height), watermark_height
+    elif watermark_width > 0 and watermark_height == 0:
+        return wm_width, int(watermark_width / wm_width * wm_height)
+    elif watermark_width > width or watermark_height > height:
+        return wm_width, wm_height
+    elif wm_width > width or wm_height > height:
+        return width, height
+    return wm_width, wm_height
+
+
+@functools.lru_cache(maxsize=4)
+def _load_watermark_image(watermark_image_path, mtime_ns):
+    with Image.open(watermark_image_path) as watermark:
+        return watermark.convert("RGBA")
+
+
+@functools.lru_cache(maxsize=16)
+def _load_scaled_watermark(watermark_image_path, mtime_ns, size):
+    watermark = _load_watermark_image(watermark_image_path, mtime_ns)
+    if watermark.size == size:
+        return watermark
+    return watermark.resize(size)
+
+
+def load_watermark_image(watermark_image_path, size=None):
+    """
+    加载水印图片，解码结果及每种缩放尺寸都在当前进程内缓存，同一批照片只解码、缩放一次
+    水印文件被修改后按修改时间重新加载
+    :param watermark_image_path: 水印图片路径
+    :param size: 缩放后的尺寸，None 表示原尺寸
+    :return: RGBA 水印图像，调用方不得修改
+    """
+    mtime_ns = os.stat(watermark_image_path).st_mtime_ns
+    if size is None:
+        return _load_watermark_image(watermark_image_path, mtime_ns)
+    return _load_scaled_watermark(watermark_image_path, mtime_ns, tuple(size))
+
+
+def render_image_watermark(image, watermark_image_path, img_position=0, watermark_width=0, watermark_height=0,
+                           w_padding=20, h_padding=20):
+    """
+    在已打开的图像上粘贴图片水印，参数含义同 add_image_watermark
+    :return: 添加水印后的 RGB 图像
+    """
+    width, height = image.size
+    # 调整水印大小（如果需要）
+    wm_size = get_watermark_size(load_watermark_image(watermark_image_path).size, image.size, watermark_width,
+                                 watermark_height)
+    watermark = load_watermark_image(watermark_image_path, wm_size)
+    # 获取截取尺寸的尺寸
+    wm_width, wm_height = watermark.size
+    # 水印位置
+    if img_position == 3:
+        position = (width - wm_width - w_padding, h_padding)
+    elif img_position == 2:
+        position = (w_padding, h_padding)
+    elif img_position == 1:
+        position = (width - wm_width - w_padding, height - wm_height - h_padding)
+    else:
+        position = (w_padding, height - wm_height - h_padding)
+    # 直接粘贴到 RGB 图像上，透明通道作为蒙版，不再创建整幅透明图层
+    if image.mode in ("RGB", "RGBA"):
+        combined = image.convert("RGB")
+    else:
+        combined = image.convert("RGBA").convert("RGB")
+    combined.paste(watermark, position, mask=watermark)
+    return combined
+
+
+def add_image_watermark(input_image_path, output_image_path, watermark_image_path, img_position=0, watermark_width=0,
+                        watermark_height=0, w_padding=20, h_padding=20, encode_options=None):
+    try:
+        with Image.open(input_image_path) as image:
+            metadata = read_photo_metadata(image) if encode_options is not None else None
+            with timed_stage('decode'):
+                image.load()
+                if encode_options is not None:
+                    image = upright_photo(image, metadata)
+            record_job_info(pixels=image.width * image.height)
+            with timed_stage('draw'):
+                final_image = render_image_watermark(image, watermark_image_path, img_position, watermark_width,
+                                                     watermark_height, w_padding, h_padding)
+        with timed_stage('encode'):
+            save_photo(final_image, output_image_path, metadata, encode_options)
+        return True
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return False
+
+
+# 内存中处理时支持的输出格式，其他格式（如手机拍摄的 MPO）输出为 JPEG
+MEMORY_OUTPUT_FORMATS = ('JPEG', 'PNG', 'WEBP')
+
+
+def watermark_image_bytes(image_bytes, watermark_type='text', watermark_text='', font_size=40, txt_position=0,
+                          padding=20, h_padding=40, bg_alpha=0, text_color_hex="FFFFFF", font_type='simsun.ttc',
+                          watermark_image_path=None, watermark_width=0, watermark_height=0, output_format=None,
+                          encode_options=None):
+    """
+    在内存中给一张照片添加水印，不读写临时文件；文字水印同 add_text_watermark2，图片水印同 add_image_watermark
+    :param image_bytes: 照片文件的内容
+    :param watermark_type: 'text' 或 'image'
+    :param output_format: 输出格式 JPEG/PNG/WEBP，None 表示与源照片相同
+    :param encode_options: photo_encode_options 的结果，None 时使用 Pillow 默认参数
+    其余参数含义同 process_directory
+    :return: (编码后的字节, 输出格式)；照片无法识别时抛出异常
+    """
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image_format = output_format or image.format
+        if image_format not in MEMORY_OUTPUT_FORMATS:
+            image_format = 'JPEG'
+        metadata = read_photo_metadata(image) if encode_options is not None else None
+        image.load()
+        if encode_options is not None:
+            image = upright_photo(image, metadata)
+        if watermark_type == 'text':
+            combined = render_text_watermark(image, watermark_text, font_size, txt_position, padding, h_padding,
+                                             bg_alpha, text_color_hex, font_type)
+        else:
+            combined = render_image_watermark(image, watermark_image_path, txt_position, watermark_width,
+                                              watermark_height, padding, h_padding)
+    buffer = io.BytesIO()
+    save_photo(combined, buffer, metadata, encode_options, image_format)
+    return buffer.getvalue(), image_format
+
+
+# 预先加载字体时覆盖的常见照片短边（像素），按常见程度排列：手机 12/48 百万像素、1080p、4K、800 万像素、2K、720p
+PRELOAD_PHOTO_SIDES = (3000, 3024, 1080, 2160, 3472, 2448, 1440, 720)
+
+
+def preload_watermark_assets(font_types=(), watermark_image_paths=(), font_size=40):
+    """
+    把字体和水印图片预先加载到当前进程的缓存中，可作为进程池的 initializer，第一张照片不再承担加载开销。
+    字体按 font_size 加载 PRELOAD_PHOTO_SIDES 中各短边实际使用的分档字号，字体较多时只加载缓存容量内最常见的几档，
+    其他尺寸的照片或字号在第一次使用时加载；无法加载的文件忽略，处理时再报错
+    """
+    sides = PRELOAD_PHOTO_SIDES[:max(load_font.cache_info().maxsize // max(len(font_types), 1), 1)]
+    sizes = sorted({caption_font_size((side, side), font_size) for side in sides})
+    for font_type in font_types:
+        try:
+            for size in sizes:
+                load_font(font_type, size)
+        except OSError:
+            pass
+    for watermark_image_path in watermark_image_paths:
+        try:
+            load_watermark_image(watermark_image_path)
+        except OSError:
+            pass
+
+
+def is_valid_watermark_image(watermark_image_path):
+    # 检查文件是否存在
+    if not os.path.exists(watermark_image_path):
+        print(f"Error: File does not exist: {watermark_image_path}", file=sys.stderr)
+        return False
+    try:
+        # 尝试打开并验证图像
+        with Image.open(watermark_image_path) as img:
+            img.verify()  # 验证图像完整性
+            # 再次打开图像以进行进一步的检查
+            img = Image.open(watermark_image_path).convert("RGBA")
+            # 检查图像尺寸
+            width, height = img.size
+            if width == 0 or height == 0:
+                print(f"Error: Invalid image size: {width}x{height}", file=sys.stderr)
+                return False
+            # 检查图像模式
+            if img.mode not in ["RGB", "RGBA"]:
+                print(f"Error: Unsupported image mode: {img.mode}", file=sys.stderr)
+                return False
+            # 可选：检查文件大小（例如不超过5MB）
+            file_size = os.path.getsize(watermark_image_path)
+            max_size_bytes = 5 * 1024 * 1024  # 5 MB
+            if file_size > max_size_bytes:
+                print(f"Error: File too large: {file_size / (1024 * 1024):.2f} MB", file=sys.stderr)
+                return False
+            return True
+    except IOError as e:
+        print(f"Error: Not a valid image file: {e}", file=sys.stderr)
+        return False
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return False
+
+
+def ignore_interrupt():
+    """
+    进程池工作进程的 initializer：忽略 Ctrl+C（终端会把信号发给整个进程组），SIGTERM 恢复默认处理，
+    取消只由主进程的 RunControl 控制，工作进程不执行从主进程继承的信号处理函数
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _watermark_photo(input_image_path, output_image_path, watermark_text, insert_watermark=None, out_date_format=0,
+                     font_size=40, txt_position=0, padding=20, h_padding=40, text_color_hex=None,
+                     font_type='simsun.ttc', watermark_type='text', watermark_image_path=None, watermark_width=0,
+                     watermark_height=0, encode_options=None):
+    """
+    对单张照片添加水印，供串行处理和进程池中的工作进程共用。
+    """
+    if watermark_type == 'text':
+        if insert_watermark is None:
+            return add_text_watermark_with_date(input_image_path, output_image_path, watermark_text, out_date_format,
+                                                font_size, txt_position, padding, h_padding, 0, text_color_hex,
+                                                font_type, encode_options)
+        return add_text_watermark2(input_image_path, output_image_path, watermark_text, font_size, txt_position,
+                                   padding, h_padding, 0, text_color_hex, font_type, encode_options)
+    return add_image_watermark(input_image_path, output_image_path, watermark_image_path, txt_position,
+                               watermark_width, watermark_height, padding, h_padding, encode_options)
+
+
+def _watermark_video(src_path, dst_path, watermark_text, insert_watermark=None, out_date_format=0, font_size=40,
+                     txt_position=0, padding=20, h_padding=40, text_color_hex=None, font_type='simsun.ttc',
+                     watermark_type='text', watermark_image_path=None, watermark_width=0, watermark_height=0,
+                     text_mode='overlay', threads=0):
+    """
+    对单个视频添加水印，供视频任务调度器调用；拍摄时间和尺寸共用一次 ffprobe 的结果
+    """
+    mark_text = watermark_text
+    video_info = None
+    if watermark_type != 'text' or insert_watermark is None or text_mode == 'overlay':
+        video_info = probe_video(src_path)
+    if watermark_type == 'text' and insert_watermark is None and video_info is not None:
+        create_date = get_video_creation_date(src_path, out_date_format, video_info)
+        if create_date:
+            mark_text = f"{create_date}\n{watermark_text}"
+    return add_watermark_ffmpeg(src_path, dst_path, mark_text, font_size, txt_position, padding, h_padding,
+                                text_color_hex, font_type, watermark_type, watermark_image_path, watermark_width,
+                                watermark_height, threads, video_info, text_mode)
+
+
+def estimate_image_memory(image_path):
+    """
+    只读取照片头信息（不解码），估算加水印时的峰值内存：解码后的图像加上转换出的 RGB 图像。
+    Pillow 中 1/L/P 模式每像素占 1 字节，I;16 占 2 字节，其余模式（包括 RGB）占 4 字节
+    :return: 估算的字节数，无法读取时返回 0
+    """
+    try:
+        with Image.open(image_path) as image:
+            pixels = image.width * image.height
+            mode = image.mode
+    except Exception:
+        return 0
+    if mode in ('1', 'L', 'P'):
+        decoded = 1
+    elif mode.startswith('I;16'):
+        decoded = 2
+    else:
+        decoded = 4
+    return pixels * (decoded + 4)
+
+
+class MemoryBudget:
+    """
+    内存预算：提交照片任务前按估算的峰值内存占用预算，预算不足时等待已提交的任务完成后再提交；
+    单独就超过预算的大图等其他任务全部完成后单独运行，从而使同时处理的照片所需内存不超过预算
+    """
+
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self.used = 0
+        self.running = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, cost, idle=None):
+        """
+        等待到预算足够时占用 cost 字节
+        :param idle: 等待期间定期调用的函数，用于收尾已完成的文件
+        """
+        while True:
+            with self._condition:
+                if self.running == 0 or self.used + cost <= self.limit:
+                    self.used += cost
+                    self.running += 1
+                    return
+                self._condition.wait(0.2)
+            if idle is not None:
+                idle()
+
+    def release(self, cost):
+        with self._condition:
+            self.used -= cost
+            self.running -= 1
+            self._condition.notify_all()
+
+    def track(self, future, cost):
+        """任务结束（完成、失败或撤销）时归还占用的预算"""
+        future.add_done_callback(lambda _: self.release(cost))
+
+
+class RunControl:
+    """
+    批处理的暂停与取消控制，界面等其他线程调用 pause/resume/cancel，处理线程在提交每个文件前检查。
+    暂停后不再提交新文件，也不再启动新的 ffmpeg，非 Windows 系统上同时挂起正在运行的 ffmpeg；
+    取消后终止正在运行的 ffmpeg，删除未完成的输出。
+    运行结束后 done 为已收尾（成功、失败或跳过）的文件数，remaining 为因取消而未处理的文件数。
+    """
+
+    def __init__(self):
+        self._cancel_event = threading.Event()
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._lock = threading.Lock()
+        self._processes = set()
+        self.done = 0
+        self.remaining = 0
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def paused(self):
+        return not self._resume_event.is_set()
+
+    def _signal_processes(self, name):
+        sig = getattr(signal, name, None)
+        if sig is None:
+            return
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            try:
+                os.kill(process.pid, sig)
+            except OSError:
+                pass
+
+    def pause(self):
+        if not self.cancelled:
+            self._resume_event.clear()
+            self._signal_processes('SIGSTOP')
+
+    def resume(self):
+        self._resume_event.set()
+        self._signal_processes('SIGCONT')
+
+    def cancel(self):
+        self._cancel_event.set()
+        self.resume()
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            try:
+                process.terminate()
+            except OSError:
+                pass
+
+    def wait_if_paused(self):
+        """
+        暂停时阻塞到继续或取消
+        :return: 是否已取消
+        """
+        self._resume_event.wait()
+        return self.cancelled
+
+    def register(self, process):
+        """登记正在运行的子进程，登记时已取消或已暂停则立即终止或挂起"""
+        with self._lock:
+            self._processes.add(process)
+        if self.cancelled:
+            process.terminate()
+        elif self.paused and hasattr(signal, 'SIGSTOP'):
+            os.kill(process.pid, signal.SIGSTOP)
+
+    def unregister(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+
+class VideoJobScheduler:
+    """
+    视频任务调度器：同时运行多个 ffmpeg 进程，每个任务的 -threads 乘以并发任务数不超过线程预算（默认 CPU 核数）。
+    被 process_directory 和 compress_process_directory 的视频处理共用，每个任务结束时立即写入日志。
+    """
+
+    def __init__(self, max_jobs=None, total_threads=None, log_func=None, control=None, job_threads=4):
+        """
+        :param max_jobs: 同时运行的 ffmpeg 进程数，None 表示按线程预算自动选择（每个任务约 job_threads 个线程）
+        :param total_threads: 所有任务的线程总预算，None 表示 CPU 核数
+        :param job_threads: 自动选择并发数时每个任务的线程数，压缩视频时为 VIDEO_PROFILES 中配置的线程数
+        :param log_func: 日志函数
+        :param control: RunControl，任务中启动的 ffmpeg 受其暂停和取消控制
+        """
+        if total_threads is None or total_threads < 1:
+            total_threads = os.cpu_count() or 1
+        if max_jobs is None or max_jobs < 1:
+            max_jobs = max(total_threads // max(job_threads, 1), 1)
+        self.max_jobs = min(max_jobs, total_threads)
+        self.threads_per_job = max(total_threads // self.max_jobs, 1)
+        self.log_func = log_func
+        self.control = control
+        self.executor = ThreadPoolExecutor(max_workers=self.max_jobs)
+
+    def submit(self, func, src_path, *args, **kwargs):
+        """
+        提交一个视频任务，func 需接受 threads 关键字参数并返回是否成功
+        :return: Future，结果为是否成功
+        """
+        kwargs['threads'] = self.threads_per_job
+        return self.executor.submit(self._run, func, src_path, args, kwargs)
+
+    def _run(self, func, src_path, args, kwargs):
+        if self.control is not None and self.control.cancelled:
+            return False
+        start = time.perf_counter()
+        success = False
+        _job_local.control = self.control
+        try:
+            success = func(src_path, *args, **kwargs)
+            return success
+        finally:
+            _job_local.control = None
+            if self.log_func:
+                elapsed = time.perf_counter() - start
+                if self.control is not None and self.control.cancelled and not success:
+                    self.log_func(f"视频任务已取消: {src_path}", "red")
+                elif success:
+                    self.log_func(f"视频任务完成: {src_path}，耗时 {elapsed:.1f} 秒", "gray")
+                else:
+                    self.log_func(f"视频任务失败: {src_path}，耗时 {elapsed:.1f} 秒", "red")
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+def _done_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _run_inline(func, *args):
+    """在当前线程内执行任务，并把结果或异常包装为 Future，与进程池的接口保持一致"""
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def file_content_hash(file_path, chunk_size=1024 * 1024):
+    """
+    计算文件内容哈希（blake2b），用于判断内容是否变化
+    :param file_path: 文件路径
+    :param chunk_size: 每次读取的字节数
+    :return: 十六进制哈希字符串
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ProcessingManifest:
+    """
+    处理清单：保存在输出根目录，记录每个源文件的大小、修改时间、可选的内容哈希以及处理参数指纹。
+    再次运行时，源文件和参数都没有变化且输出仍然存在的文件直接跳过，只处理新增、变化或上次失败的文件。
+    """
+    FILE_NAME = '.watermark_manifest.json'
+
+    def __init__(self, root_dir, out_root, params, use_hash=False, save_interval=50):
+        """
+        :param root_dir: 源文件根路径
+        :param out_root: 输出根路径，清单文件保存在此目录
+        :param params: 影响输出内容的处理参数，参数变化后所有文件都会重新处理
+        :param use_hash: 是否记录内容哈希；修改时间变化但内容相同的文件也会被跳过
+        :param save_interval: 每记录多少个文件写一次磁盘，中途中断时最多只需重做这么多文件
+        """
+        self.root_dir = root_dir
+        self.out_root = out_root
+        self.path = os.path.join(out_root, self.FILE_NAME)
+        params_str = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        self.fingerprint = hashlib.sha1(params_str.encode('utf-8')).hexdigest()
+        self.use_hash = use_hash
+        self.save_interval = save_interval
+        self.entries = {}
+        self.dirty = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == 1:
+                self.entries = data.get('files', {})
+        except (OSError, ValueError):
+            pass
+
+    def _key(self, src_path):
+        return os.path.relpath(src_path, self.root_dir).replace(os.sep, '/')
+
+    def _output_key(self, output_path):
+        return os.path.relpath(output_path, self.out_root).replace(os.sep, '/')
+
+    def is_up_to_date(self, src_path, output_path):
+        """
+        判断源文件上次是否已按相同参数处理成功，且输出文件仍然存在
+        """
+        entry = self.entries.get(self._key(src_path))
+        if not entry or entry.get('status') != 'ok' or entry.get('fingerprint') != self.fingerprint:
+            return False
+        if entry.get('output') != self._output_key(output_path) or not os.path.exists(output_path):
+            return False
+        try:
+            stat = os.stat(src_path)
+        except OSError:
+            return False
+        if stat.st_size != entry.get('size'):
+            return False
+        if stat.st_mtime_ns == entry.get('mtime_ns'):
+            return True
+        # 修改时间变化但内容未变（例如被重新拷贝）时，用内容哈希确认
+        if self.use_hash and entry.get('hash') and file_content_hash(src_path) == entry['hash']:
+            entry['mtime_ns'] = stat.st_mtime_ns
+            self.dirty += 1
+            return True
+        return False
+
+    def recorded_output(self, src_path):
+        """源文件上次按相同参数处理成功时的输出路径，没有时返回 None"""
+        entry = self.entries.get(self._key(src_path))
+        if not entry or entry.get('status') != 'ok' or entry.get('fingerprint') != self.fingerprint \
+                or not entry.get('output'):
+            return None
+        return os.path.join(self.out_root, *entry['output'].split('/'))
+
+    def output_names(self, save_dir):
+        """清单中输出到 save_dir 目录的所有文件名（包括参数已变化的记录），用于确定下一个可用编号"""
+        if getattr(self, '_output_names', None) is None:
+            self._output_names = {}
+            for entry in self.entries.values():
+                if entry.get('output'):
+                    directory, _, name = entry['output'].rpartition('/')
+                    self._output_names.setdefault(directory or '.', []).append(name)
+        return self._output_names.get(self._output_key(save_dir), [])
+
+    def failed_before(self, src_path):
+        """源文件未变化且上次按相同参数处理失败，用于预测本次的输出编号"""
+        entry = self.entries.get(self._key(src_path))
+        if not entry or entry.get('status') != 'failed' or entry.get('fingerprint') != self.fingerprint:
+            return False
+        return self.stat(src_path) == (entry.get('size'), entry.get('mtime_ns'))
+
+    def stat(self, src_path):
+        """在处理前记录源文件状态，避免处理过程中文件被修改却被记为最新"""
+        try:
+            stat = os.stat(src_path)
+            return stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    def record(self, src_path, output_path, success, src_stat=None):
+        """
+        记录一个文件的处理结果
+        :param src_stat: 处理前 stat() 的结果，为 None 时重新读取
+        """
+        if src_stat is None:
+            src_stat = self.stat(src_path)
+        if src_stat is None:
+            return
+        entry = {
+            'size': src_stat[0],
+            'mtime_ns': src_stat[1],
+            'fingerprint': self.fingerprint,
+            'status': 'ok' if success else 'failed',
+            'output': self._output_key(output_path) if output_path else None,
+        }
+        if self.use_hash and success:
+            try:
+                entry['hash'] = file_content_hash(src_path)
+            except OSError:
+                pass
+        self.entries[self._key(src_path)] = entry
+        self.dirty += 1
+        if self.dirty >= self.save_interval:
+            self.save()
+
+    def save(self):
+        """先写临时文件再替换，中途中断不会损坏已有清单"""
+        if not self.dirty:
+            return
+        os.makedirs(self.out_root, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'files': self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = 0
+
+
+# 重复内容的输出生成方式：link 先尝试硬链接（与首个输出共用数据），copy 为写时复制/内核复制/普通复制
+DEDUP_MODES = ('link', 'copy')
+
+
+class SourceDeduplicator:
+    """
+    一次运行内按源文件内容去重：内容和处理参数都相同的文件只处理一次，其余文件的输出从第一次的输出硬链接或复制。
+    先按文件大小筛选，出现大小相同的文件时才计算内容哈希，大小唯一的文件不需要读取内容
+    """
+
+    def __init__(self, mode='link'):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"未知的去重方式: {mode}，可选 {', '.join(DEDUP_MODES)}")
+        self.mode = mode
+        # 文件大小 -> 尚未计算哈希的已提交文件；计算过后置为 None，此后该大小的文件都直接计算哈希
+        self.by_size = {}
+        # (内容哈希, 处理参数) -> 第一次处理该内容的 _PendingFile
+        self.originals = {}
+        self.hashes = {}
+        self.saved = 0
+
+    @staticmethod
+    def _job_key(job):
+        func, args, ext = job
+        return func, json.dumps(args, sort_keys=True, default=str, ensure_ascii=False), ext
+
+    def _hash(self, path):
+        digest = self.hashes.get(path)
+        if digest is None:
+            with timed_stage('hash'):
+                digest = file_content_hash(path)
+            self.hashes[path] = digest
+        return digest
+
+    def _register(self, pending):
+        key = (self._hash(pending.input_path), self._job_key(pending.job))
+        self.originals.setdefault(key, pending)
+
+    def find(self, input_path, job):
+        """
+        查找内容和处理参数都相同、已提交处理的文件
+        :param job: (处理函数, 附加参数, 输出扩展名)
+        :return: 该文件的 _PendingFile，没有时返回 None
+        """
+        try:
+            size = os.path.getsize(input_path)
+        except OSError:
+            return None
+        if size not in self.by_size:
+            return None
+        unhashed = self.by_size[size]
+        if unhashed is not None:
+            self.by_size[size] = None
+            for pending in unhashed:
+                self._register(pending)
+        try:
+            original = self.originals.get((self._hash(input_path), self._job_key(job)))
+        except OSError:
+            return None
+        if original is not None:
+            self.saved += 1
+        return original
+
+    def add(self, pending):
+        """登记一个实际提交处理的文件"""
+        try:
+            size = os.path.getsize(pending.input_path)
+        except OSError:
+            return
+        unhashed = self.by_size.setdefault(size, [])
+        if unhashed is None:
+            try:
+                self._register(pending)
+            except OSError:
+                pass
+        else:
+            unhashed.append(pending)
+
+
+def _detach_output(output_path):
+    """输出文件是硬链接（与源文件或其他输出共用数据）时先删除，避免覆盖写入时改动共用的数据"""
+    try:
+        if os.lstat(output_path).st_nlink > 1:
+            os.remove(output_path)
+    except OSError:
+        pass
+
+
+def _output_state(output_path):
+    """输出文件在提交处理前的状态（不存在时为 None），取消时据此判断文件是否由本次运行写入"""
+    try:
+        stat = os.stat(output_path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _copy_duplicate_output(src_path, dst_path, original_output, mode):
+    """
+    用内容相同的文件已生成的输出作为本文件的输出
+    :param original_output: 已生成的输出路径
+    :param mode: DEDUP_MODES 之一
+    """
+    try:
+        with timed_stage('copy'):
+            method = passthrough_copy(original_output, dst_path, 'link' if mode == 'link' else 'fast')
+        record_job_info(dedup_of=original_output, copy_method=method)
+        return True
+    except Exception as e:
+        print(f"err:{e}", file=sys.stderr)
+        return False
+
+
+_SKIPPED = 'skipped'
+
+
+class _PendingFile:
+    """一个已提交、尚未收尾的文件"""
+    __slots__ = ('future', 'input_path', 'output_path', 'is_tmp', 'job', 'src_stat', 'expect_success', 'copy_from',
+                 'prior_state', 'numbered')
+
+    def __init__(self, future, input_path, output_path, is_tmp=False, job=None, src_stat=None,
+                 expect_success=True, copy_from=None, prior_state=None, numbered=True):
+        self.future = future
+        self.input_path = input_path
+        self.output_path = output_path
+        self.is_tmp = is_tmp
+        # (处理函数, 附加参数, 输出扩展名)，编号变化需要重新处理或临时文件改名时使用
+        self.job = job
+        self.src_stat = src_stat
+        self.expect_success = expect_success
+        # 内容相同、已提交处理的文件，收尾时从它的输出硬链接或复制
+        self.copy_from = copy_from
+        # 提交时输出路径上已有文件的状态，见 _output_state
+        self.prior_state = prior_state
+        # 是否按顺序占用一个重命名编号；追加编号时沿用上次输出名称的文件不占用
+        self.numbered = numbered
+
+
+class _OrderedOutputs:
+    """
+    按源文件顺序收尾同一目录下的处理结果。
+    并行处理时各文件的完成顺序不固定，需要重命名的输出先写入临时文件，
+    再按原顺序编号改名，保证 file_counter 与串行处理的结果一致。
+    追加编号（append_numbers）时已处理过的文件沿用清单中的输出名称，新文件的编号接在目录中已有的最大编号之后。
+    """
+
+    def __init__(self, save_dir, out_file_name, log_func=None, manifest=None, progress_func=None, metrics=None,
+                 control=None, dedup=None, append_numbers=False):
+        self.save_dir = save_dir
+        self.out_file_name = out_file_name
+        self.log_func = log_func
+        self.manifest = manifest
+        self.progress_func = progress_func
+        self.metrics = metrics
+        self.control = control
+        self.dedup = dedup
+        self.append_numbers = append_numbers and manifest is not None and out_file_name is not None
+        self.file_counter = self._next_number() if self.append_numbers else 1
+        self.pending = []
+        self.tmp_counter = 0
+        # 输出目录只在提交第一个文件时创建一次
+        self.dir_ready = False
+
+    def _numbered_path(self, counter, ext):
+        return os.path.join(self.save_dir, f"{self.out_file_name}_{counter}{ext}")
+
+    def _number_of(self, name):
+        """按当前重命名规则输出的文件名中的编号，不符合规则时返回 None"""
+        prefix = f"{self.out_file_name}_"
+        if not name.startswith(prefix):
+            return None
+        number = name[len(prefix):].split('.', 1)[0]
+        return int(number) if number.isdigit() else None
+
+    def _next_number(self):
+        """清单记录和输出目录中已有的最大编号加 1，已被取走（删除）的输出的编号也不再使用"""
+        names = list(self.manifest.output_names(self.save_dir))
+        try:
+            names.extend(os.listdir(self.save_dir))
+        except OSError:
+            pass
+        numbers = [number for number in map(self._number_of, names) if number is not None]
+        return max(numbers, default=0) + 1
+
+    def _previous_output(self, input_path, ext):
+        """追加编号时源文件上次的输出路径（同一目录、同一命名规则和扩展名），源文件变化后仍写到该路径"""
+        recorded = self.manifest.recorded_output(input_path)
+        if recorded is None or os.path.dirname(recorded) != os.path.normpath(self.save_dir):
+            return None
+        name = os.path.basename(recorded)
+        if self._number_of(name) is None or not name.endswith(ext):
+            return None
+        return recorded
+
+    def output_path(self, file_name, deferred=False, suffix=None):
+        """
+        获取本次处理的输出路径
+        :param file_name: 源文件名
+        :param deferred: 是否异步处理；异步且需要重命名时返回临时路径，收尾时再改名
+        :param suffix: 追加在文件名后的输出格式扩展名，如 'jpeg'
+        :return: (输出路径, 是否为临时路径)
+        """
+        tail = f".{suffix}" if suffix else ''
+        if self.out_file_name is None:
+            return os.path.join(self.save_dir, file_name) + tail, False
+        ext = os.path.splitext(file_name)[1]
+        if deferred or self.pending:
+            self.tmp_counter += 1
+            return os.path.join(self.save_dir, f".~wm_{self.tmp_counter}{ext}{tail}"), True
+        return self._numbered_path(self.file_counter, f"{ext}{tail}"), False
+
+    def submit(self, executor, file_name, input_path, func, *args, suffix=None):
+        """
+        提交一个文件的处理任务
+        :param executor: 进程池或视频任务调度器，None 表示在当前线程内直接处理
+        :param file_name: 源文件名
+        :param input_path: 源文件路径
+        :param func: 处理函数，调用方式为 func(源文件路径, 输出路径, *args)，返回是否成功
+        :param suffix: 追加在文件名后的输出格式扩展名
+        :return: 任务的 Future
+        """
+        if not self.dir_ready:
+            os.makedirs(self.save_dir, exist_ok=True)
+            self.dir_ready = True
+        ext = os.path.splitext(file_name)[1] + (f".{suffix}" if suffix else '')
+        job = (func, args, ext)
+        src_stat = None
+        expect_success = True
+        if self.append_numbers:
+            previous = self._previous_output(input_path, ext)
+            if previous is not None:
+                return self._submit_named(executor, input_path, previous, func, args, job)
+            src_stat = self.manifest.stat(input_path)
+        elif self.manifest is not None:
+            # 按上次的处理结果预测前面未完成文件的成败，从而预测本文件的编号，收尾时编号不符则重新处理
+            if self.out_file_name is None:
+                predicted_path = os.path.join(self.save_dir, file_name) + (f".{suffix}" if suffix else '')
+            else:
+                expected = sum(1 for pending in self.pending if pending.expect_success)
+                predicted_path = self._numbered_path(self.file_counter + expected, ext)
+            if self.manifest.is_up_to_date(input_path, predicted_path):
+                future = _done_future(_SKIPPED)
+                self.add(_PendingFile(future, input_path, predicted_path, job=job))
+                return future
+            src_stat = self.manifest.stat(input_path)
+            expect_success = not self.manifest.failed_before(input_path)
+        original = self.dedup.find(input_path, job) if self.dedup is not None else None
+        if original is not None:
+            # 内容和参数相同的文件已提交，不再处理，收尾时从它的输出生成
+            output_path, is_tmp = self.output_path(file_name, True, suffix)
+            _detach_output(output_path)
+            self.add(_PendingFile(original.future, input_path, output_path, is_tmp, job, src_stat, expect_success,
+                                  original, _output_state(output_path)))
+            return original.future
+        output_path, is_tmp = self.output_path(file_name, executor is not None, suffix)
+        return self._run(executor, input_path, output_path, func, args, _PendingFile(
+            None, input_path, output_path, is_tmp, job, src_stat, expect_success))
+
+    def _submit_named(self, executor, input_path, output_path, func, args, job):
+        """追加编号时处理已有输出名称的文件：未变化时跳过，变化时写回原来的输出，不占用新编号"""
+        if self.manifest.is_up_to_date(input_path, output_path):
+            future = _done_future(_SKIPPED)
+            self.add(_PendingFile(future, input_path, output_path, job=job, numbered=False))
+            return future
+        pending = _PendingFile(None, input_path, output_path, False, job, self.manifest.stat(input_path),
+                               numbered=False)
+        original = self.dedup.find(input_path, job) if self.dedup is not None else None
+        if original is not None:
+            _detach_output(output_path)
+            pending.future, pending.copy_from, pending.prior_state = original.future, original, \
+                _output_state(output_path)
+            self.add(pending)
+            return original.future
+        return self._run(executor, input_path, output_path, func, args, pending)
+
+    def _run(self, executor, input_path, output_path, func, args, pending):
+        """提交处理任务并登记 pending"""
+        _detach_output(output_path)
+        pending.prior_state = _output_state(output_path)
+        if self.metrics is not None:
+            func, args = _timed_job, (func,) + args
+        if executor is None:
+            future = _run_inline(func, input_path, output_path, *args)
+        else:
+            future = executor.submit(func, input_path, output_path, *args)
+        pending.future = future
+        if self.dedup is not None:
+            self.dedup.add(pending)
+        self.add(pending)
+        return future
+
+    def add(self, pending):
+        self.pending.append(pending)
+        self.flush()
+
+    def _cancelled(self, input_path, output_path, prior_state=None):
+        """
+        取消时只删除本次运行写入的不完整输出；输出路径上的文件与提交前相同（任务未开始）时，
+        是上次运行留下的完整输出，保留不动
+        """
+        if output_path is not None and _output_state(output_path) not in (None, prior_state):
+            os.remove(output_path)
+        self.control.remaining += 1
+        if self.progress_func:
+            self.progress_func('cancelled', input_path, None)
+
+    def _copy_duplicate(self, pending, output_path, success):
+        """
+        内容相同的文件处理成功后，从它的输出生成本文件的输出
+        :return: (是否成功, 指标)
+        """
+        if not success:
+            return False, None
+        args = (pending.copy_from.output_path, self.dedup.mode)
+        if self.metrics is None:
+            return _copy_duplicate_output(pending.input_path, output_path, *args), None
+        result = _timed_job(pending.input_path, output_path, _copy_duplicate_output, *args)
+        return result.success, result.metrics
+
+    def flush(self):
+        """按顺序收尾已完成的结果，遇到未完成的文件即停止"""
+        while self.pending and self.pending[0].future.done():
+            pending = self.pending.pop(0)
+            input_path = pending.input_path
+            output_path = pending.output_path
+            src_stat = pending.src_stat
+            try:
+                success = pending.future.result()
+            except CancelledError:
+                success = False
+            except Exception as e:
+                logging.error(f"{input_path} 处理异常：{e}")
+                success = False
+            if success == _SKIPPED:
+                func, args, ext = pending.job
+                expected_path = output_path
+                if self.out_file_name is not None and pending.numbered:
+                    expected_path = self._numbered_path(self.file_counter, ext)
+                if expected_path == output_path:
+                    if self.log_func:
+                        self.log_func(f"已跳过: {input_path} -> {output_path}", "gray")
+                    if self.progress_func:
+                        self.progress_func('skipped', input_path, output_path)
+                    if self.metrics is not None:
+                        self.metrics.record(input_path, output_path, 'skipped')
+                    if self.control is not None:
+                        self.control.done += 1
+                    if pending.numbered:
+                        self.file_counter += 1
+                    continue
+                if self.control is not None and self.control.cancelled:
+                    self._cancelled(input_path, None)
+                    continue
+                # 前面有文件的成败与上次不同导致编号变化，按新的编号重新处理
+                output_path = expected_path
+                _detach_output(output_path)
+                src_stat = self.manifest.stat(input_path)
+                try:
+                    if self.metrics is not None:
+                        success = _timed_job(input_path, output_path, func, *args)
+                    else:
+                        success = func(input_path, output_path, *args)
+                except Exception as e:
+                    logging.error(f"{input_path} 处理异常：{e}")
+                    success = False
+            job_metrics = None
+            if isinstance(success, JobResult):
+                success, job_metrics = success.success, success.metrics
+            if pending.copy_from is not None:
+                success, job_metrics = self._copy_duplicate(pending, output_path, success)
+            if not success and output_path is not None and self.control is not None and self.control.cancelled:
+                # 取消导致未完成（未开始或 ffmpeg 被终止），删除本次写入的不完整输出
+                self._cancelled(input_path, output_path, pending.prior_state)
+                continue
+            if success:
+                if pending.is_tmp:
+                    final_path = self._numbered_path(self.file_counter, pending.job[2])
+                    os.replace(output_path, final_path)
+                    output_path = final_path
+                    # 内容相同的文件可能稍后才收尾，需要从新的位置生成
+                    pending.output_path = final_path
+                if self.log_func:
+                    self.log_func(f"已处理: {input_path} -> {output_path}", "gray")  # 中间信息使用灰色字体
+                if self.progress_func:
+                    self.progress_func('ok', input_path, output_path)
+                if pending.numbered:
+                    self.file_counter += 1
+            else:
+                if pending.is_tmp and os.path.exists(output_path):
+                    os.remove(output_path)
+                if self.log_func:
+                    self.log_func(f"处理失败: {input_path}", "red")  # 错误信息使用红色字体
+                if self.progress_func:
+                    self.progress_func('failed', input_path, None)
+            if self.metrics is not None:
+                self.metrics.record(input_path, output_path if success else None, 'ok' if success else 'failed',
+                                    job_metrics)
+            if self.control is not None:
+                self.control.done += 1
+            if self.manifest is not None and output_path is not None:
+                self.manifest.record(input_path, output_path if success else None, success, src_stat)
+        return not self.pending
+
+
+def percentile(sorted_values, percent):
+    """最近秩法计算分位数，sorted_values 需已升序排列"""
+    index = max(-(-len(sorted_values) * percent // 100) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+class RunMetrics:
+    """
+    运行指标：每个文件收尾时向 JSON 行文件写一条记录（总耗时、各阶段耗时、输入输出字节数、像素数或视频时长、工作进程），
+    运行结束时追加一条汇总：文件数/秒、MB/秒、按照片和视频分别统计的 p50/p95/p99 耗时以及最慢的文件
+    """
+    VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.flv', '.wmv', '.mpeg', '.mpg')
+
+    def __init__(self, path, slowest=10):
+        """
+        :param path: 指标文件路径，已存在时追加
+        :param slowest: 汇总中列出的最慢文件数
+        """
+        self.path = path
+        self.slowest = slowest
+        self.records = []
+        self.start = time.perf_counter()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    @staticmethod
+    def _size(path):
+        try:
+            return os.path.getsize(path) if path else 0
+        except OSError:
+            return 0
+
+    def record(self, input_path, output_path, status, job_metrics=None):
+        """
+        记录一个文件的处理结果
+        :param status: ok、failed 或 skipped
+        :param job_metrics: _timed_job 统计的指标，跳过或处理异常时为 None
+        """
+        record = {
+            'event': 'file',
+            'status': status,
+            'media': 'video' if input_path.lower().endswith(self.VIDEO_EXTENSIONS) else 'photo',
+            'src': input_path,
+            'dst': output_path,
+            'input_bytes': self._size(input_path),
+            'output_bytes': self._size(output_path),
+        }
+        if job_metrics:
+            record.update(job_metrics)
+        self.records.append(record)
+        self._write(record)
+
+    def summary(self):
+        """写入并返回本次运行的汇总"""
+        elapsed = time.perf_counter() - self.start
+        processed = [record for record in self.records if record['status'] != 'skipped']
+        timed = [record for record in processed if 'seconds' in record]
+        mb = sum(record['input_bytes'] for record in processed) / (1024 * 1024)
+        latency = {}
+        for media in sorted({record['media'] for record in timed}):
+            seconds = sorted(record['seconds'] for record in timed if record['media'] == media)
+            latency[media] = {
+                'count': len(seconds),
+                'p50': percentile(seconds, 50),
+                'p95': percentile(seconds, 95),
+                'p99': percentile(seconds, 99),
+            }
+        slowest = sorted(timed, key=lambda record: record['seconds'], reverse=True)[:self.slowest]
+        summary = {
+            'event': 'summary',
+            'ok': sum(1 for record in self.records if record['status'] == 'ok'),
+            'failed': sum(1 for record in self.records if record['status'] == 'failed'),
+            'skipped': len(self.records) - len(processed),
+            'elapsed': round(elapsed, 3),
+            'files_per_sec': round(len(processed) / elapsed, 3) if elapsed > 0 else 0,
+            'mb_per_sec': round(mb / elapsed, 3) if elapsed > 0 else 0,
+            'latency': latency,
+            'slowest': [{'src': record['src'], 'seconds': record['seconds'], 'stages': record.get('stages', {})}
+                        for record in slowest],
+        }
+        self._write(summary)
+        return summary
+
+    def close(self):
+        self.file.close()
+
+
+def _finish_metrics(metrics, log_func=None):
+    """写入汇总、关闭指标文件，并把吞吐量写到日志"""
+    summary = metrics.summary()
+    metrics.close()
+    if log_func:
+        log_func(f"指标已写入 {metrics.path}：{summary['ok'] + summary['failed']} 个文件，"
+                 f"{summary['files_per_sec']} 个/秒，{summary['mb_per_sec']} MB/秒", "gray")
+
+
+def _flush_outputs(all_outputs, block=False, control=None):
+    """
+    收尾所有目录中已完成的结果，返回仍有未完成任务的目录
+    :param block: 为 True 时一直等待到所有任务完成，每完成一个任务收尾一次，保证日志持续输出
+    :param control: RunControl；等待期间被取消时，撤销尚未开始的任务
+    """
+    all_outputs = [outputs for outputs in all_outputs if not outputs.flush()]
+    while block and all_outputs:
+        if control is not None and control.cancelled:
+            for outputs in all_outputs:
+                for pending in outputs.pending:
+                    pending.future.cancel()
+        wait([outputs.pending[0].future for outputs in all_outputs], timeout=None if control is None else 0.5,
+             return_when=FIRST_COMPLETED)
+        all_outputs = [outputs for outputs in all_outputs if not outputs.flush()]
+    return all_outputs
+
+
+def _wait_to_submit(control, all_outputs, max_in_flight):
+    """
+    受 RunControl 控制时，提交下一个文件前调用：暂停时等待继续；未完成的任务达到上限时等待其中一个完成，
+    避免一次把整个目录都排进队列，暂停和取消都能及时生效
+    :return: 是否已取消
+    """
+    while not control.wait_if_paused():
+        running = [pending.future for outputs in all_outputs for pending in outputs.pending
+                   if not pending.future.done()]
+        if len(running) < max_in_flight:
+            return False
+        wait(running, timeout=0.5, return_when=FIRST_COMPLETED)
+        _flush_outputs(all_outputs)
+    return True
+
+
+def _count_remaining(files, walker, is_target):
+    """取消后统计当前目录剩余和尚未遍历的目录中需要处理的文件数"""
+    count = sum(1 for file_name in files if is_target(file_name))
+    for _, entries in walker:
+        count += sum(1 for entry in entries if is_target(entry.name))
+    return count
+
+
+def scan_directory(root_dir):
+    """
+    用 os.scandir 自顶向下逐个目录遍历，产出 (目录路径, 文件的 DirEntry 列表)，目录和文件的顺序与 os.walk 一致。
+    每读完一个目录就产出，处理可以立即开始，不需要等待整棵目录树遍历完成；无法读取的目录跳过
+    """
+    stack = [root_dir]
+    while stack:
+        top = stack.pop()
+        try:
+            with os.scandir(top) as iterator:
+                entries = list(iterator)
+        except OSError:
+            continue
+        dirs = []
+        files = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            (dirs if is_dir else files).append(entry)
+        yield top, files
+        # 与 os.walk 一样不进入指向目录的符号链接；倒序入栈以保持原来的遍历顺序
+        for entry in reversed(dirs):
+            if not entry.is_symlink():
+                stack.append(entry.path)
+
+
+def is_watermark_target(file_name):
+    """process_directory 处理的文件：照片和 mp4 视频"""
+    return file_name.lower().endswith(('png', 'jpg', 'jpeg', 'mp4'))
+
+
+class ProgressTracker:
+    """
+    整体进度：后台线程遍历目录统计需要处理的文件总数和总字节数，不阻塞处理；每收尾一个文件更新一次已完成数量。
+    界面可随时读取 fraction()/eta() 显示进度条和剩余时间，总数统计完成前 total_known 为 False。
+    """
+
+    def __init__(self):
+        self.total_files = 0
+        self.total_bytes = 0
+        self.total_known = False
+        self.done_files = 0
+        self.done_bytes = 0
+        # 实际处理（不含跳过）的字节数，用于估算速度
+        self.processed_bytes = 0
+        self.start = None
+        self._stop_event = threading.Event()
+
+    def start_counting(self, root_dir, is_target):
+        self.start = time.perf_counter()
+        threading.Thread(target=self._count, args=(root_dir, is_target), daemon=True).start()
+
+    def _count(self, root_dir, is_target):
+        for _, entries in scan_directory(root_dir):
+            if self._stop_event.is_set():
+                return
+            for entry in entries:
+                if is_target(entry.name):
+                    try:
+                        size = entry.stat().st_size
+                    except OSError:
+                        size = 0
+                    self.total_files += 1
+                    self.total_bytes += size
+        self.total_known = True
+
+    def stop(self):
+        self._stop_event.set()
+
+    def file_done(self, input_path, skipped=False):
+        try:
+            size = os.path.getsize(input_path)
+        except OSError:
+            size = 0
+        self.done_files += 1
+        self.done_bytes += size
+        if not skipped:
+            self.processed_bytes += size
+
+    def wrap(self, progress_func=None):
+        """返回先更新进度再调用 progress_func 的回调，供目录处理函数使用"""
+        def report(status, input_path, output_path):
+            if status in ('ok', 'failed', 'skipped'):
+                self.file_done(input_path, status == 'skipped')
+            if progress_func:
+                progress_func(status, input_path, output_path)
+        return report
+
+    def fraction(self):
+        """已完成比例（按字节计算，总字节数为 0 时按文件数）"""
+        if self.total_bytes:
+            return min(self.done_bytes / self.total_bytes, 1.0)
+        if self.total_files:
+            return min(self.done_files / self.total_files, 1.0)
+        return 0.0
+
+    def eta(self):
+        """按实际处理的速度估算剩余秒数；总数尚未统计完或还没有处理完任何文件时返回 None"""
+        if not self.total_known or self.start is None or not self.processed_bytes:
+            return None
+        elapsed = time.perf_counter() - self.start
+        return max(self.total_bytes - self.done_bytes, 0) * elapsed / self.processed_bytes
+
+
+def _log_cancelled(control, log_func):
+    if control is not None and control.cancelled and log_func:
+        log_func(f"已取消：已完成 {control.done} 个文件，剩余 {control.remaining} 个文件未处理", "red")
+
+
+def _log_dedup(dedup, log_func):
+    if dedup is not None and dedup.saved and log_func:
+        method = '硬链接' if dedup.mode == 'link' else '复制'
+        log_func(f"内容重复的文件 {dedup.saved} 个，未重复处理，已从相同内容的输出{method}", "gray")
+
+
+def _manifest_params(**params):
+    """整理处理参数用于清单指纹；水印图片按路径、大小和修改时间区分"""
+    logo = params.get('watermark_image_path')
+    if logo and os.path.exists(logo):
+        stat = os.stat(logo)
+        params['watermark_image_path'] = (logo, stat.st_size, stat.st_mtime_ns)
+    return params
+
+
+def process_directory(root_dir, out_path=None, out_file_name=None, is_add_video_water=False, out_date_format=0,
+                      font_size=40, txt_position=0, padding=20, h_padding=40, log_func=None, text_color_hex=None,
+                      insert_watermark=None, font_type='simsun.ttc', watermark_type='text', watermark_image_path=None,
+                      watermark_width=0, watermark_height=0, max_workers=None, video_jobs=None, incremental=False,
+                      hash_files=False, progress_func=None, passthrough='copy', video_text_mode='overlay',
+                      metrics_path=None, control=None, tracker=None, memory_budget_mb=None, photo_encode=None,
+                      dedup=None, executor=None, file_filter=None, append_numbers=False):
+    # 边距仅对文字水印有效，图片水印不在针对不同尺寸的照片进行相关尺寸自适应适配
+    if watermark_type == 'text':
+        if font_size < 1 or font_size > 100:
+            font_size = 40
+        if padding < 0 or padding > 200:
+            padding = 20
+        if h_padding < 0 or h_padding > 200:
+            h_padding = 40
+    # 照片并行处理的进程数，默认使用 CPU 核数；为 1 时在当前进程内逐个处理
+    if max_workers is None or max_workers < 1:
+        max_workers = os.cpu_count() or 1
+    manifest = None
+    if incremental:
+        manifest = ProcessingManifest(root_dir, out_path if out_path is not None else f"{root_dir}_out",
+                                      _manifest_params(mode='watermark', is_add_video_water=is_add_video_water,
+                                                       out_date_format=out_date_format, font_size=font_size,
+                                                       txt_position=txt_position, padding=padding,
+                                                       h_padding=h_padding, text_color_hex=text_color_hex,
+                                                       insert_watermark=insert_watermark, font_type=font_type,
+                                                       watermark_type=watermark_type,
+                                                       video_text_mode=video_text_mode,
+                                                       watermark_image_path=watermark_image_path,
+                                                       watermark_width=watermark_width,
+                                                       watermark_height=watermark_height,
+                                                       photo_encode=photo_encode),
+                                      hash_files)
+    metrics = RunMetrics(metrics_path) if metrics_path else None
+    if tracker is not None:
+        tracker.start_counting(root_dir, is_watermark_target)
+        progress_func = tracker.wrap(progress_func)
+    # 由调用方传入的进程池在多次调用之间保持工作进程（及其中缓存的字体和水印图片），结束时不关闭
+    pool = executor
+    scheduler = VideoJobScheduler(video_jobs, log_func=log_func, control=control) if is_add_video_water else None
+    max_in_flight = 2 * (max_workers + (scheduler.max_jobs if scheduler is not None else 0))
+    budget = MemoryBudget(memory_budget_mb * 1024 * 1024) if memory_budget_mb and max_workers > 1 else None
+    dedup = SourceDeduplicator(dedup) if dedup else None
+    all_outputs = []
+    _job_local.control = control
+    try:
+        walker = scan_directory(root_dir)
+        for subdir, entries in walker:
+            files = [entry.name for entry in entries if file_filter is None or file_filter(entry.path)]
+            if insert_watermark:
+                watermark_text = insert_watermark
+            else:
+                watermark_text = ''.join([char for char in os.path.basename(subdir) if '\u4e00' <= char <= '\u9fff'])
+            if out_path is None:
+                out_dir = f"{root_dir}_out"
+                relative_path = os.path.relpath(subdir, root_dir)
+                save_dir = os.path.join(out_dir, relative_path)
+            else:
+                relative_path = os.path.relpath(subdir, root_dir)
+                save_dir = os.path.join(out_path, relative_path)
+            outputs = _OrderedOutputs(save_dir, out_file_name, log_func, manifest, progress_func, metrics, control,
+                                      dedup, append_numbers)
+            all_outputs.append(outputs)
+            for index, file_name in enumerate(files):
+                if control is not None and _wait_to_submit(control, all_outputs, max_in_flight):
+                    control.remaining += _count_remaining(
+                        files[index:], walker, is_watermark_target)
+                    break
+                input_image_path = os.path.join(subdir, file_name)
+                # 照片添加水印
+                if file_name.lower().endswith(('png', 'jpg', 'jpeg')):
+                    if max_workers > 1 and pool is None:
+                        pool = ProcessPoolExecutor(max_workers=max_workers, initializer=ignore_interrupt)
+                    if budget is not None:
+                        cost = estimate_image_memory(input_image_path)
+                        budget.acquire(cost, lambda: _flush_outputs(all_outputs))
+                    future = outputs.submit(pool, file_name, input_image_path, _watermark_photo, watermark_text,
+                                            insert_watermark, out_date_format, font_size, txt_position, padding,
+                                            h_padding, text_color_hex, font_type, watermark_type,
+                                            watermark_image_path, watermark_width, watermark_height,
+                                            photo_encode)
+                    if budget is not None:
+                        budget.track(future, cost)
+                # 视频添加水印
+                elif file_name.lower().endswith('mp4'):
+                    if is_add_video_water:
+                        outputs.submit(scheduler, file_name, input_image_path, _watermark_video, watermark_text,
+                                       insert_watermark, out_date_format, font_size, txt_position, padding,
+                                       h_padding, text_color_hex, font_type, watermark_type, watermark_image_path,
+                                       watermark_width, watermark_height, video_text_mode)
+                    else:
+                        outputs.submit(None, file_name, input_image_path, copy_video_and_rename, passthrough)
+            all_outputs = _flush_outputs(all_outputs)
+        # 等待剩余的并行任务
+        _flush_outputs(all_outputs, block=True, control=control)
+        _log_cancelled(control, log_func)
+        _log_dedup(dedup, log_func)
+    finally:
+        _job_local.control = None
+        if tracker is not None:
+            tracker.stop()
+        if pool is not None and pool is not executor:
+            pool.shutdown()
+        if scheduler is not None:
+            scheduler.shutdown()
+        if manifest is not None:
+            manifest.save()
+        if metrics is not None:
+            _finish_metrics(metrics, log_func)
+
+
+def quality_percentage_to_qv(percentage):
+    """
+    将压缩质量百分比转换为 -q:v 参数值。
+    :param percentage: 质量百分比 (0-100)
+    :return: 对应的 -q:v 参数值
+    """
+    if percentage < 0 or percentage > 100:
+        percentage = 75
+    # 计算 -q:v 值，假设100%对应-q:v 1, 0%对应-q:v 31
+    qv_value = 32 - (percentage / 100) * 31
+    return round(qv_value)  # 四舍五入取整
+
+
+def compress_ratio_to_crf(compress_ratio):
+    """
+    将压缩比例（0% 到 100%）映射到 -crf 参数（0 到 51）。
+    """
+    if not (0 <= compress_ratio <= 100):
+        compress_ratio = 80
+    # 线性映射
+    crf_value = 18 + (100 - compress_ratio) / 100 * 31
+    return round(crf_value)
+
+
+def qv_to_pillow_quality(qv_value):
+    """
+    将 -q:v 参数值换算为 Pillow 的 JPEG/WebP quality，-q:v 1 对应 100，-q:v 31 对应 5
+    :param qv_value: quality_percentage_to_qv 的结果
+    :return: Pillow quality
+    """
+    return max(1, min(100, round(100 - (qv_value - 1) * 95 / 30)))
+
+
+def get_photo_size(image_size, deal_size_way="original_size", scale=100, width=1080, height=1920):
+    """
+    按 ffmpeg scale 滤镜的规则计算缩放后的尺寸；指定尺寸为 0 表示使用原值，为负数表示按另一边等比例计算
+    :return: (宽, 高)，不缩放时返回 None
+    """
+    in_width, in_height = image_size
+    if deal_size_way == "scale_size":
+        return max(int(in_width * scale / 100), 1), max(int(in_height * scale / 100), 1)
+    if deal_size_way == "specify_size":
+        out_width = in_width if width == 0 else width
+        out_height = in_height if height == 0 else height
+        if out_width < 0 and out_height < 0:
+            return in_width, in_height
+        if out_width < 0:
+            out_width = int(in_width * out_height / in_height)
+        elif out_height < 0:
+            out_height = int(in_height * out_width / in_width)
+        return max(out_width, 1), max(out_height, 1)
+    return None
+
+
+def get_crop_box(image_size, crop_center=0, crop_width=720, crop_height=720):
+    """
+    计算裁剪区域，与 ffmpeg crop 滤镜的参数一致
+    :param crop_center: 参考点：0=居中，1=左上角，2=右上角，3=左下角，4=右下角
+    :return: (左, 上, 右, 下)
+    """
+    in_width, in_height = image_size
+    out_width = min(crop_width, in_width)
+    out_height = min(crop_height, in_height)
+    if crop_center == 1:
+        x, y = 0, 0
+    elif crop_center == 2:
+        x, y = in_width - out_width, 0
+    elif crop_center == 3:
+        x, y = 0, in_height - out_height
+    elif crop_center == 4:
+        x, y = in_width - out_width, in_height - out_height
+    else:
+        x, y = (in_width - out_width) // 2, (in_height - out_height) // 2
+    return x, y, x + out_width, y + out_height
+
+
+def _load_compress_photo(input_image_path, deal_size_way="original_size", scale=100, width=1080, height=1920,
+                         crop_center=0, crop_width=720, crop_height=720):
+    """
+    读取照片并按尺寸处理方式缩放或裁剪，JPEG 缩小时使用 draft 模式在解码阶段直接按 1/2、1/4、1/8 缩小，减少解码量
+    :return: 处理后的图像
+    """
+    with Image.open(input_image_path) as image:
+        record_job_info(pixels=image.width * image.height)
+        size = get_photo_size(image.size, deal_size_way, scale, width, height)
+        if size is not None and image.format == 'JPEG' and size[0] < image.size[0] and size[1] < image.size[1]:
+            image.draft(image.mode, size)
+        with timed_stage('decode'):
+            image.load()
+        with timed_stage('resize'):
+            if size is not None:
+                return image.resize(size, Image.BICUBIC) if size != image.size else image.copy()
+            if deal_size_way == "crop_size":
+                return image.crop(get_crop_box(image.size, crop_center, crop_width, crop_height))
+            return image.copy()
+
+
+def compress_photo_pillow(input_image_path, output_image_path, quality=75, deal_size_way="original_size", scale=100,
+                          width=1080, height=1920, crop_center=0, crop_width=720, crop_height=720):
+    """
+    在当前进程内用 Pillow 压缩单张照片，尺寸处理和质量换算与 ffmpeg 方式一致，省去每张照片启动一次 ffmpeg 的开销
+    参数含义同 compress_process_directory
+    :return: 是否成功
+    """
+    try:
+        result = _load_compress_photo(input_image_path, deal_size_way, scale, width, height, crop_center, crop_width,
+                                      crop_height)
+        ext = os.path.splitext(output_image_path)[1].lower()
+        output_format = Image.registered_extensions().get(ext)
+        params = {}
+        if output_format in ('JPEG', 'WEBP'):
+            params['quality'] = qv_to_pillow_quality(quality_percentage_to_qv(quality))
+        with timed_stage('encode'):
+            if output_format == 'JPEG' and result.mode not in ('RGB', 'L', 'CMYK'):
+                result = result.convert('RGB')
+            result.save(output_image_path, output_format, **params)
+        return True
+    except Exception as e:
+        print(f"err:{e}", file=sys.stderr)
+        return False
+
+
+def _encode_photo(image, output_format, quality):
+    """把图像编码到内存中，返回编码后的字节"""
+    params = {'quality': quality} if output_format in ('JPEG', 'WEBP') else {}
+    if output_format == 'PNG':
+        params['optimize'] = True
+    buffer = io.BytesIO()
+    image.save(buffer, output_format, **params)
+    return buffer.getvalue()
+
+
+def compress_photo_to_size(input_image_path, output_image_path, target_kb, deal_size_way="original_size", scale=100,
+                           width=1080, height=1920, crop_center=0, crop_width=720, crop_height=720, hint=None,
+                           max_attempts=10, min_quality=30, min_scale=10):
+    """
+    把照片压缩到不超过指定大小：在内存中反复编码查找满足大小的最高质量，质量降到 min_quality 仍超出时按比例缩小尺寸，
+    只把最终结果写入磁盘。PNG 等无损格式只缩小尺寸
+    :param target_kb: 目标大小上限（KB）
+    :param hint: dict，按输出格式分别记录上一张照片最终使用的质量和缩小后的像素数（失败时为已估算出的值），
+        下一张同格式的照片从该质量和尺寸开始查找，同一目录的照片通常只需 2-4 次编码；缩小后的像素数只作为起点，
+        先确认原尺寸在 min_quality 下仍超出目标大小才会缩小
+    :param max_attempts: 每张照片最多编码的次数，用完仍未找到满足大小的结果时不写出文件并返回失败
+    :param min_quality: 查找质量的下限，低于该质量时改为缩小尺寸
+    :param min_scale: 缩小尺寸的下限，原图（尺寸处理后）宽高的百分比
+    其余参数含义同 compress_process_directory
+    :return: 是否成功
+    """
+    target_bytes = int(target_kb * 1024)
+    hints = hint if hint is not None else {}
+    try:
+        image = _load_compress_photo(input_image_path, deal_size_way, scale, width, height, crop_center, crop_width,
+                                     crop_height)
+        output_format = Image.registered_extensions().get(os.path.splitext(output_image_path)[1].lower())
+        if output_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+            image = image.convert('RGB')
+        lossy = output_format in ('JPEG', 'WEBP')
+        # 无损格式只能缩小尺寸，各格式的结果互不参考
+        hint = hints.setdefault(output_format, {})
+        min_q, max_q = (min_quality, 95) if lossy else (0, 0)
+        quality = min(max(hint.get('quality', 75), min_q), max_q)
+        attempts = 0
+        best = None
+        ratio = 1.0
+        low = min_q
+        if hint.get('pixels', image.width * image.height) < image.width * image.height:
+            # 上一张照片需要缩小、本张照片像素数更多时，很可能也需要缩小：先按最低质量编码原尺寸，
+            # 超出时按本张照片的大小估算缩小比例，满足时在原尺寸下向上查找质量
+            attempts += 1
+            with timed_stage('encode'):
+                data = _encode_photo(image, output_format, min_q)
+            if len(data) <= target_bytes:
+                best = (min_q, 1.0, image.width * image.height, data)
+                low = min_q + 1
+            else:
+                ratio = max((target_bytes / len(data)) ** 0.5 * 0.95, 0.1)
+                quality = min_q
+        while attempts < max_attempts and ratio * 100 >= min_scale:
+            with timed_stage('resize'):
+                candidate = image if ratio >= 1.0 else image.resize(
+                    (max(int(image.width * ratio), 1), max(int(image.height * ratio), 1)), Image.BICUBIC)
+            # 在 [low, high] 中查找满足大小的最高质量：满足时按 2、4、8 的步长向上试探，出现超出后二分；
+            # 第一次就超出时直接尝试最低质量，最低质量仍超出时不再降低质量，改为缩小尺寸
+            high = max_q
+            quality = min(max(quality, low), high)
+            step = 2
+            exceeded = None
+            while low <= high and attempts < max_attempts:
+                attempts += 1
+                with timed_stage('encode'):
+                    data = _encode_photo(candidate, output_format, quality)
+                if len(data) <= target_bytes:
+                    best = (quality, ratio, candidate.width * candidate.height, data)
+                    low = quality + 1
+                    # 已接近目标大小时不再提高质量
+                    if len(data) >= target_bytes * 0.95:
+                        break
+                    quality = (low + high) // 2 if exceeded is not None else min(quality + step, high)
+                    step *= 2
+                else:
+                    exceeded = len(data)
+                    high = quality - 1
+                    quality = low if best is None else (low + high) // 2
+            low = min_q
+            if best is not None or exceeded is None or attempts >= max_attempts:
+                break
+            # 最低质量仍超出目标大小：文件大小约与像素数成正比，按面积比缩小，留 10% 余量
+            ratio *= max((target_bytes / exceeded) ** 0.5 * 0.95, 0.1)
+            if ratio * 100 < min_scale:
+                break
+            # 缩小后的尺寸按最低质量估算，从最低质量开始向上查找
+            quality = min_q
+        record_job_info(attempts=attempts)
+        if best is None:
+            # 失败时也记录已经找到的缩小比例，后面的照片直接从该尺寸开始
+            hint['quality'] = min_q
+            if ratio < 1.0:
+                hint['pixels'] = max(int(image.width * ratio) * int(image.height * ratio), 1)
+            print(f"err:{input_image_path} 在 {attempts} 次尝试内无法压缩到 {target_kb} KB 以内", file=sys.stderr)
+            return False
+        quality, ratio, pixels, data = best
+        if lossy:
+            hint['quality'] = quality
+            record_job_info(quality=quality)
+        if ratio < 1.0:
+            hint['pixels'] = pixels
+        else:
+            hint.pop('pixels', None)
+        record_job_info(scale=round(ratio * 100, 1))
+        with timed_stage('encode'):
+            with open(output_image_path, 'wb') as f:
+                f.write(data)
+        return True
+    except Exception as e:
+        print(f"err:{e}", file=sys.stderr)
+        return False
+
+
+def compress_photo_ffmpeg(input_image_path, output_image_path, quality=75, deal_size_way="original_size", scale=100,
+                          width=1080, height=1920, crop_center=0, crop_width=720, crop_height=720):
+    """
+    使用 ffmpeg 压缩单张照片，参数含义同 compress_process_directory
+    :return: 是否成功
+    """
+    photo_scale = 'scale=iw*1:ih*1'
+    if deal_size_way == "scale_size":
+        photo_scale = f'scale=iw*{scale / 100}:ih*{scale / 100}'
+    elif deal_size_way == "specify_size":
+        photo_scale = f'scale={width}:{height}'
+    elif deal_size_way == "crop_size":
+        if crop_center == 1:
+            photo_scale = f'crop=min({crop_width}\\, in_w):min({crop_height}\\, in_h):0:0'
+        elif crop_center == 2:
+            photo_scale = f'crop=min({crop_width}\\, in_w):min({crop_height}\\, in_h):(in_w-min({crop_width}\\, in_w)):0'
+        elif crop_center == 3:
+            photo_scale = f'crop=min({crop_width}\\, in_w):min({crop_height}\\, in_h):0:(in_h-min({crop_height}\\, in_h))'
+        elif crop_center == 4:
+            photo_scale = f'crop=min({crop_width}\\, in_w):min({crop_height}\\, in_h):(in_w-min({crop_width}\\, in_w)):(in_h-min({crop_height}\\, in_h))'
+        else:
+            photo_scale = f'crop=min(iw\\,{crop_width}):min(ih\\,{crop_height}):(iw-min(iw\\,{crop_width}))/2:(ih-min(ih\\,{crop_height}))/2'
+
+    command_str = rf'ffmpeg -y -i "{input_image_path}" -vf "{photo_scale}" -q:v {quality_percentage_to_qv(quality)} -update 1 "{output_image_path}"'
+    print(command_str, file=sys.stderr)
+    try:
+        result = run_ffmpeg_command(command_str)
+    except Exception as e:
+        logging.error(f"FFmpeg {input_image_path} 错误信息： {str(e)}")
+        return False
+    return result.returncode == 0
+
+
+def compress_photo(input_image_path, output_image_path, quality=75, deal_size_way="original_size", scale=100,
+                   width=1080, height=1920, crop_center=0, crop_width=720, crop_height=720, engine='pillow'):
+    """
+    压缩单张照片
+    :param engine: 'pillow' 在当前进程内处理；'ffmpeg' 为每张照片启动一次 ffmpeg
+    """
+    if engine == 'ffmpeg':
+        return compress_photo_ffmpeg(input_image_path, output_image_path, quality, deal_size_way, scale, width,
+                                     height, crop_center, crop_width, crop_height)
+    return compress_photo_pillow(input_image_path, output_image_path, quality, deal_size_way, scale, width, height,
+                                 crop_center, crop_width, crop_height)
+
+
+# 视频压缩配置：preset 为 x264 编码速度档位，crf_offset 叠加在压缩质量换算出的 crf 上，
+# maxrate/bufsize 为 crf 之外的码率上限（None 表示不限制），threads 为每个 ffmpeg 任务的线程数：
+# 快速档位多线程收益小，用较少线程同时运行更多任务；慢速档位每个任务用更多线程，调度器据此减少并发任务数
+VIDEO_PROFILES = {
+    'fast': {'preset': 'veryfast', 'crf_offset': 2, 'maxrate': '2M', 'bufsize': '4M', 'threads': 2},
+    'balanced': {'preset': 'medium', 'crf_offset': 0, 'maxrate': '4M', 'bufsize': '8M', 'threads': 4},
+    'archival': {'preset': 'slow', 'crf_offset': -4, 'maxrate': None, 'bufsize': None, 'threads': 8},
+}
+
+
+def get_video_codecs(output_path):
+    """
+    按输出容器选择视频、音频编码器；x264 系列容器才支持 preset 和 crf
+    :return: (视频编码器, 音频编码器)
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext == '.wmv':
+        return 'wmv2', 'wmav2'
+    if ext in ('.mpeg', '.mpg'):
+        return 'mpeg2video', 'mp2'
+    return 'libx264', 'aac'
+
+
+def build_video_compress_command(input_path, output_path, quality=75, profile=None, threads=0):
+    """
+    生成视频压缩命令
+    :param quality: 压缩质量百分比
+    :param profile: VIDEO_PROFILES 中的配置名称，None 表示沿用固定的 -crf/-b:v 500k/-r 24 参数
+    :param threads: ffmpeg 编码线程数，0 表示使用配置中的线程数
+    """
+    if profile is None:
+        threads_arg = f'-threads {threads} ' if threads > 0 else ''
+        return rf'ffmpeg -y -i "{input_path}" -crf {compress_ratio_to_crf(quality)} -b:v 500k -r 24 -b:a 128k {threads_arg}"{output_path}"'
+    settings = VIDEO_PROFILES[profile]
+    threads = threads or settings['threads']
+    threads_arg = f'-threads {threads} ' if threads > 0 else ''
+    video_codec, audio_codec = get_video_codecs(output_path)
+    if video_codec == 'libx264':
+        crf = min(max(compress_ratio_to_crf(quality) + settings['crf_offset'], 0), 51)
+        rate_args = f'-preset {settings["preset"]} -crf {crf}'
+        if settings['maxrate']:
+            # crf 加码率上限（受限 crf），避免复杂画面码率失控
+            rate_args += f' -maxrate {settings["maxrate"]} -bufsize {settings["bufsize"]}'
+        rate_args += ' -pix_fmt yuv420p'
+    else:
+        rate_args = f'-q:v {quality_percentage_to_qv(quality)}'
+    return rf'ffmpeg -y -i "{input_path}" -c:v {video_codec} {rate_args} -c:a {audio_codec} -b:a 128k {threads_arg}"{output_path}"'
+
+
+# 各输出容器可以直接存放（无需重新编码）的视频、音频编码，名称与 ffprobe 的 codec_name 一致
+CONTAINER_CODECS = {
+    '.mp4': ({'h264', 'hevc', 'mpeg4', 'av1', 'vp9'}, {'aac', 'mp3', 'ac3', 'eac3', 'opus', 'alac'}),
+    '.mov': ({'h264', 'hevc', 'mpeg4', 'prores', 'mjpeg'}, {'aac', 'mp3', 'ac3', 'alac', 'pcm_s16le', 'pcm_s24le'}),
+    '.avi': ({'h264', 'mpeg4', 'mjpeg', 'msmpeg4v2', 'msmpeg4v3'}, {'mp3', 'ac3', 'pcm_s16le'}),
+    '.flv': ({'h264', 'flv1'}, {'aac', 'mp3'}),
+    '.wmv': ({'wmv1', 'wmv2', 'wmv3', 'vc1'}, {'wmav1', 'wmav2'}),
+    '.mpeg': ({'mpeg1video', 'mpeg2video'}, {'mp2', 'mp3', 'ac3'}),
+    '.mpg': ({'mpeg1video', 'mpeg2video'}, {'mp2', 'mp3', 'ac3'}),
+}
+
+
+def can_remux(video_info, output_path):
+    """
+    判断视频能否不重新编码、只换容器
+    :param video_info: probe_video 读取的视频信息
+    :param output_path: 输出路径，按扩展名确定容器
+    :return: 源视频、音频编码都能直接放入目标容器时返回 True
+    """
+    if video_info is None or not video_info.codec:
+        return False
+    codecs = CONTAINER_CODECS.get(os.path.splitext(output_path)[1].lower())
+    if codecs is None:
+        return False
+    video_codecs, audio_codecs = codecs
+    return video_info.codec in video_codecs and (video_info.audio_codec is None or video_info.audio_codec in audio_codecs)
+
+
+def build_video_remux_command(input_path, output_path):
+    """生成只换容器的命令：复制第一路视频和全部音频，丢弃目标容器可能不支持的字幕、时间码等数据流"""
+    faststart = '-movflags +faststart ' if output_path.lower().endswith(('.mp4', '.mov')) else ''
+    return rf'ffmpeg -y -i "{input_path}" -map 0:v:0 -map 0:a? -c copy {faststart}"{output_path}"'
+
+
+def compress_video(input_path, output_path, quality=75, profile=None, remux=False, threads=0):
+    """
+    使用 ffmpeg 压缩单个视频
+    :param quality: 压缩质量百分比
+    :param profile: 压缩配置名称，见 VIDEO_PROFILES
+    :param remux: 只转换容器格式；源编码可直接放入目标容器时不重新编码，否则仍按 quality/profile 重新编码
+    :param threads: ffmpeg 编码线程数，0 表示由配置或 ffmpeg 自行决定
+    :return: 是否成功
+    """
+    command_str = None
+    if remux:
+        if can_remux(probe_video(input_path), output_path):
+            command_str = build_video_remux_command(input_path, output_path)
+        else:
+            logging.info(f"{input_path} 的编码不能直接放入目标格式，重新编码")
+    if command_str is None:
+        command_str = build_video_compress_command(input_path, output_path, quality, profile, threads)
+    print(command_str, file=sys.stderr)
+    try:
+        result = run_ffmpeg_command(command_str)
+    except Exception as e:
+        logging.error(f"FFmpeg {input_path} 错误信息： {str(e)}")
+        return False
+    return result.returncode == 0
+
+
+def benchmark_video_profiles(sample_path, profiles=None, quality=75, threads=0, out_dir=None):
+    """
+    用样例视频依次测试各压缩配置的编码速度和输出大小，测试输出在结束后删除
+    :param sample_path: 样例视频
+    :param profiles: 要测试的配置名称，None 表示全部
+    :param quality: 压缩质量百分比
+    :param threads: 编码线程数，0 表示使用配置中的线程数
+    :param out_dir: 临时输出目录，None 表示系统临时目录
+    :return: 每个配置一条结果：profile、threads、success、seconds、fps、output_bytes、size_ratio
+    """
+    info = probe_video(sample_path)
+    frames = info.frames if info else 0
+    input_bytes = os.path.getsize(sample_path)
+    ext = os.path.splitext(sample_path)[1] or '.mp4'
+    results = []
+    with tempfile.TemporaryDirectory(dir=out_dir) as tmp_dir:
+        for profile in profiles or list(VIDEO_PROFILES):
+            output_path = os.path.join(tmp_dir, f"{profile}{ext}")
+            start = time.perf_counter()
+            success = compress_video(sample_path, output_path, quality, profile, threads=threads)
+            seconds = time.perf_counter() - start
+            output_bytes = os.path.getsize(output_path) if success and os.path.exists(output_path) else 0
+            results.append({
+                'profile': profile,
+                'threads': threads or VIDEO_PROFILES[profile]['threads'],
+                'success': success,
+                'seconds': round(seconds, 3),
+                'fps': round(frames / seconds, 2) if success and seconds > 0 else 0,
+                'output_bytes': output_bytes,
+                'size_ratio': round(output_bytes / input_bytes, 4) if input_bytes else 0,
+            })
+    return results
+
+
+def compress_process_directory(root_dir, out_path, out_file_name, is_add_video_water, log_func=None, quality=75,
+                               photo_format=0, video_format=0, deal_size_way="original_size", scale=100, width=1080,
+                               height=1920, crop_center=0, crop_width=720, crop_height=720, video_jobs=None,
+                               incremental=False, hash_files=False, progress_func=None, photo_engine='pillow',
+                               video_profile=None, passthrough='copy', video_remux=False, metrics_path=None,
+                               control=None, tracker=None, target_kb=None, dedup=None, file_filter=None,
+                               append_numbers=False):
+    manifest = None
+    if incremental:
+        manifest = ProcessingManifest(root_dir, out_path if out_path is not None else f"{root_dir}_out",
+                                      _manifest_params(mode='compress', is_add_video_water=is_add_video_water,
+                                                       quality=quality, photo_format=photo_format,
+                                                       video_format=video_format, deal_size_way=deal_size_way,
+                                                       scale=scale, width=width, height=height,
+                                                       crop_center=crop_center, crop_width=crop_width,
+                                                       crop_height=crop_height, photo_engine=photo_engine,
+                                                       video_profile=video_profile, video_remux=video_remux,
+                                                       target_kb=target_kb),
+                                      hash_files)
+    metrics = RunMetrics(metrics_path) if metrics_path else None
+    if tracker is not None:
+        tracker.start_counting(root_dir, lambda name: True)
+        progress_func = tracker.wrap(progress_func)
+    job_threads = VIDEO_PROFILES[video_profile]['threads'] if video_profile else 4
+    scheduler = VideoJobScheduler(video_jobs, log_func=log_func, control=control,
+                                  job_threads=job_threads) if is_add_video_water else None
+    max_in_flight = 2 * (1 + (scheduler.max_jobs if scheduler is not None else 0))
+    # 目标大小模式下照片在当前进程内依次处理，上一张照片找到的质量作为下一张的起点
+    compress_to_size = functools.partial(compress_photo_to_size, hint={})
+    dedup = SourceDeduplicator(dedup) if dedup else None
+    all_outputs = []
+    _job_local.control = control
+    try:
+        walker = scan_directory(root_dir)
+        for subdir, entries in walker:
+            files = [entry.name for entry in entries if file_filter is None or file_filter(entry.path)]
+            if out_path is None:
+                out_dir = f"{root_dir}_out"
+                relative_path = os.path.relpath(subdir, root_dir)
+                save_dir = os.path.join(out_dir, relative_path)
+            else:
+                relative_path = os.path.relpath(subdir, root_dir)
+                save_dir = os.path.join(out_path, relative_path)
+            outputs = _OrderedOutputs(save_dir, out_file_name, log_func, manifest, progress_func, metrics, control,
+                                      dedup, append_numbers)
+            all_outputs.append(outputs)
+            for index, file_name in enumerate(files):
+                if control is not None and _wait_to_submit(control, all_outputs, max_in_flight):
+                    control.remaining += _count_remaining(files[index:], walker, lambda name: True)
+                    break
+                input_image_path = os.path.join(subdir, file_name)
+                # 照片压缩
+                if file_name.lower().endswith(('png', 'jpg', 'jpeg', 'webp')):
+                    extensions = {1: 'png', 2: 'jpeg', 3: 'webp'}
+                    if target_kb:
+                        outputs.submit(None, file_name, input_image_path, compress_to_size, target_kb,
+                                       deal_size_way, scale, width, height, crop_center, crop_width, crop_height,
+                                       suffix=extensions.get(photo_format))
+                    else:
+                        outputs.submit(None, file_name, input_image_path, compress_photo, quality, deal_size_way,
+                                       scale, width, height, crop_center, crop_width, crop_height, photo_engine,
+                                       suffix=extensions.get(photo_format))
+                # 视频压缩
+                elif file_name.lower().endswith(('mp4', 'avi', 'mov', 'flv', 'wmv', 'mpeg', 'mpg')):
+                    if is_add_video_water:
+                        extensions = {1: 'mp4', 2: 'avi', 3: 'mov', 4: 'flv', 5: 'wmv', 6: 'mpeg', 7: 'mpg'}
+                        outputs.submit(scheduler, file_name, input_image_path, compress_video, quality,
+                                       video_profile, video_remux, suffix=extensions.get(video_format))
+                    else:
+                        outputs.submit(None, file_name, input_image_path, copy_video_and_rename, passthrough)
+                else:
+                    outputs.add(_PendingFile(_done_future(False), input_image_path, None))
+            all_outputs = _flush_outputs(all_outputs)
+        _flush_outputs(all_outputs, block=True, control=control)
+        _log_cancelled(control, log_func)
+        _log_dedup(dedup, log_func)
+    finally:
+        _job_local.control = None
+        if tracker is not None:
+            tracker.stop()
+        if scheduler is not None:
+            scheduler.shutdown()
+        if manifest is not None:
+            manifest.save()
+        if metrics is not None:
+            _finish_metrics(metrics, log_func)
+
+
+# inotify 事件：写入后关闭、移入、新建（新建目录时需要添加监视）、事件队列溢出、监视被移除、对象是目录
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def _file_state(path):
+    """文件的 (大小, 修改时间)，文件不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+    except OSError:
+        return None
+
+
+class FolderWatcher:
+    """
+    监视目录树中新增或写入的文件。Linux 上通过 ctypes 使用 inotify，没有文件变化时不占用 CPU；
+    其他系统或 inotify 不可用（如监视的目录数超过系统上限）时，定时遍历目录比较文件大小和修改时间
+    """
+
+    def __init__(self, root_dir, poll_interval=2.0, use_inotify=True):
+        """
+        :param poll_interval: 轮询方式下遍历目录的间隔秒数
+        :param use_inotify: 为 False 时始终使用轮询
+        """
+        self.root_dir = root_dir
+        self.poll_interval = poll_interval
+        self.libc = None
+        self.fd = None
+        self.watches = {}
+        self.snapshot = None
+        self.next_poll = 0.0
+        if use_inotify and sys.platform.startswith('linux'):
+            self._init_inotify()
+        if self.fd is None:
+            self._start_polling(self._scan())
+
+    @property
+    def mode(self):
+        return 'inotify' if self.fd is not None else 'poll'
+
+    def _init_inotify(self):
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        self.libc, self.fd = libc, fd
+        if self._add_tree(self.root_dir) is None:
+            self.close()
+
+    def _add_tree(self, top):
+        """
+        监视 top 及其所有子目录
+        :return: 其中已有的文件路径列表（目录在添加监视前写入的文件不会产生事件）；添加监视失败时返回 None
+        """
+        files = []
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        for subdir, entries in scan_directory(top):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(subdir), mask)
+            if wd < 0:
+                return None
+            self.watches[wd] = subdir
+            files.extend(entry.path for entry in entries)
+        return files
+
+    def _scan(self):
+        snapshot = {}
+        for subdir, entries in scan_directory(self.root_dir):
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                snapshot[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def _start_polling(self, snapshot):
+        self.close()
+        self.snapshot = snapshot
+        self.next_poll = time.monotonic() + self.poll_interval
+
+    def wait(self, timeout):
+        """
+        等待文件变化，最多等待 timeout 秒
+        :return: 新增或写入过的文件路径集合
+        """
+        if self.fd is not None:
+            return self._read_events(timeout)
+        delay = self.next_poll - time.monotonic()
+        if delay > 0:
+            time.sleep(min(delay, timeout))
+            if time.monotonic() < self.next_poll:
+                return set()
+        self.next_poll = time.monotonic() + self.poll_interval
+        snapshot = self._scan()
+        changed = {path for path, state in snapshot.items() if self.snapshot.get(path) != state}
+        self.snapshot = snapshot
+        return changed
+
+    def _read_events(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        changed = set()
+        offset = 0
+        while offset + _INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = data[offset:offset + length].split(b'\0', 1)[0]
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                # 事件丢失，把目录中所有文件都作为可能变化的文件
+                changed.update(self._scan())
+                continue
+            if mask & _IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            subdir = self.watches.get(wd)
+            if subdir is None or not name:
+                continue
+            path = os.path.join(subdir, os.fsdecode(name))
+            if not mask & _IN_ISDIR:
+                changed.add(path)
+                continue
+            if mask & (_IN_CREATE | _IN_MOVED_TO):
+                files = self._add_tree(path)
+                if files is None:
+                    # 监视的目录数超过系统上限，改为轮询，下次等待时把所有文件都作为新文件
+                    self._start_polling({})
+                    self.next_poll = 0.0
+                    return changed
+                changed.update(files)
+        return changed
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.watches = {}
+
+
+def watch_directory(root_dir, process_func, is_target=is_watermark_target, settle=2.0, poll_interval=2.0,
+                    control=None, log_func=None, use_inotify=True):
+    """
+    持续监视目录：启动时先处理一次已有的文件，之后每当有新文件写入完成（大小和修改时间保持 settle 秒不变，
+    正在上传或复制的文件不会被处理）就再处理一次，直到 control 被取消。
+    process_func(file_filter) 应以增量方式处理整个目录，由处理清单跳过已处理的文件，并使用 append_numbers 保持已有输出的名称；
+    file_filter(源文件路径) 为 False 的文件仍在写入，本次不处理
+    :param is_target: 判断文件名是否需要处理，其他文件的变化不触发处理
+    :param settle: 文件大小和修改时间保持不变多少秒后视为写入完成
+    :param poll_interval: 不支持 inotify 时遍历目录的间隔秒数
+    :param control: RunControl，取消后停止监视；正在进行的处理按取消处理
+    :param use_inotify: 为 False 时始终使用轮询
+    """
+    watcher = FolderWatcher(root_dir, poll_interval, use_inotify)
+    if log_func:
+        how = 'inotify' if watcher.mode == 'inotify' else f"每 {poll_interval} 秒轮询"
+        log_func(f"开始监视目录: {root_dir}（{how}），文件 {settle} 秒内不再变化后处理", "gray")
+    # 仍在写入的文件：路径 -> ((大小, 修改时间), 最近一次发现变化的时间)
+    unstable = {}
+    now = time.monotonic()
+    recent = time.time_ns() - int(settle * 1e9)
+    for subdir, entries in scan_directory(root_dir):
+        for entry in entries:
+            state = _file_state(entry.path) if is_target(entry.name) else None
+            if state is not None and state[1] > recent:
+                unstable[entry.path] = (state, now)
+    try:
+        process_func(lambda path: path not in unstable)
+        while control is None or not control.cancelled:
+            changed = watcher.wait(min(settle / 2, 1.0) if unstable else 1.0)
+            now = time.monotonic()
+            for path in changed:
+                if is_target(os.path.basename(path)):
+                    unstable[path] = (_file_state(path), now)
+            ready = 0
+            for path, (state, since) in list(unstable.items()):
+                current = _file_state(path)
+                if current is None:
+                    del unstable[path]
+                elif current != state:
+                    unstable[path] = (current, now)
+                elif now - since >= settle:
+                    del unstable[path]
+                    ready += 1
+            if ready and (control is None or not control.cancelled):
+                if log_func:
+                    log_func(f"发现 {ready} 个新文件，开始处理", "gray")
+                process_func(lambda path: path not in unstable)
+    finally:
+        watcher.close()
+
+
+def is_integer(value):
+    """
+    判断一个值是否为整型。
+    支持 int、float（整数值）、和可转换为整数的字符串。
+    """
+    if isinstance(value, int):
+        return True
+    elif isinstance(value, float):
+        return value.is_integer()
+    elif isinstance(value, str):
+        try:
+            float_value = float(value)
+            return float_value.is_integer()
+        except ValueError:
+            return False
+    else:
+        try:
+            int(value)
+            return True
+        except (ValueError, TypeError):
+            return False
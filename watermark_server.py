@@ -0,0 +1,414 @@
+"""
+本机 HTTP 加水印服务，只使用标准库，只监听回环地址，供其他工具按需给单张照片加水印。
+
+照片在常驻的工作进程池中处理，工作进程启动时预先加载水印图片和字体（常见照片尺寸在默认字号下用到的各档字号），
+之后的请求不再承担解释器启动、导入 PIL 和解析字体的开销；照片在内存中解码、加水印、编码，不读写临时文件。
+处理中和排队的请求数达到上限时立即返回 503 和 Retry-After，由调用方稍后重试。
+
+接口：
+    POST /watermark?参数   请求体为照片文件内容，返回加水印后的照片
+    GET  /metrics          运行指标（JSON）：请求数、各状态码数量、拒绝数、处理中数量、耗时分位数等
+    GET  /health           服务状态
+
+/watermark 的参数（查询字符串）：
+    type=text|image           文字水印（默认）或图片水印
+    text=水印文字              文字水印内容，换行用 %0A
+    position=0-3               0=左下角，1=右下角，2=左上角，3=右上角
+    padding / h_padding        水平、垂直边距
+    font_size / color / bg_alpha / font    字号、文字颜色（HEX）、背景透明度、字体（须为启动时 --font 指定的字体）
+    logo / wm_width / wm_height            图片水印（须为启动时 --logo 指定的图片，可只写文件名）及其宽高
+    format=jpeg|png|webp       输出格式，默认与源照片相同
+    quality / subsampling / baseline=1 / strip_metadata=1   输出编码参数，见 watermark_core.photo_encode_options
+
+示例：
+    python watermark_server.py --port 8765 --font C:/Windows/Fonts/simsun.ttc --logo logo.png --workers 4
+    curl --data-binary @a.jpg "http://127.0.0.1:8765/watermark?text=2025%E5%B7%A1%E6%A3%80&position=1" -o a_wm.jpg
+    curl --data-binary @a.jpg "http://127.0.0.1:8765/watermark?type=image&logo=logo.png" -o a_logo.jpg
+    curl http://127.0.0.1:8765/metrics
+"""
+import argparse
+import functools
+import ipaddress
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import UnidentifiedImageError
+
+from watermark_core import (PHOTO_SUBSAMPLING, convert_color_to_numeric, is_color, photo_encode_options,
+                            percentile, preload_watermark_assets, watermark_image_bytes)
+
+CONTENT_TYPES = {'JPEG': 'image/jpeg', 'PNG': 'image/png', 'WEBP': 'image/webp'}
+OUTPUT_FORMATS = {'jpeg': 'JPEG', 'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+
+
+class RequestError(Exception):
+    """请求参数错误，status 为返回的 HTTP 状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ServiceMetrics:
+    """服务运行指标，处理线程并发更新"""
+
+    def __init__(self, window=1000):
+        """
+        :param window: 统计耗时分位数时使用最近多少个成功的请求
+        """
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.requests = 0
+        self.statuses = Counter()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, status, seconds=None, bytes_in=0, bytes_out=0):
+        with self.lock:
+            self.requests += 1
+            self.statuses[str(status)] += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            if seconds is not None:
+                self.latencies.append(seconds)
+
+    @staticmethod
+    def _latency_ms(sorted_values, percent):
+        """与运行指标汇总相同的分位数算法，单位毫秒"""
+        if not sorted_values:
+            return None
+        return round(percentile(sorted_values, percent) * 1000, 1)
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            uptime = time.time() - self.start
+            return {
+                'uptime': round(uptime, 1),
+                'requests': self.requests,
+                'statuses': dict(self.statuses),
+                'rejected': self.statuses.get('503', 0),
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'requests_per_sec': round(self.requests / uptime, 3) if uptime > 0 else 0,
+                'latency_ms': {
+                    'count': len(latencies),
+                    'p50': self._latency_ms(latencies, 50),
+                    'p95': self._latency_ms(latencies, 95),
+                    'p99': self._latency_ms(latencies, 99),
+                },
+            }
+
+
+class WatermarkService:
+    """
+    常驻的工作进程池：处理中和排队的请求数达到 workers + queue_size 时拒绝新请求；
+    工作进程异常退出导致进程池损坏时重建进程池
+    """
+
+    def __init__(self, workers=None, queue_size=None, font_types=('simsun.ttc',), watermark_image_paths=(),
+                 timeout=60.0, max_upload_mb=50):
+        """
+        :param workers: 工作进程数，默认使用 CPU 核数
+        :param queue_size: 工作进程都在处理时最多排队的请求数，默认与工作进程数相同
+        :param font_types: 允许使用的字体，第一个为默认字体
+        :param watermark_image_paths: 允许使用的水印图片
+        :param timeout: 单个请求最长等待秒数，超时返回 504
+        :param max_upload_mb: 上传照片的大小上限（MB）
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.capacity = self.workers + (queue_size if queue_size is not None else self.workers)
+        self.font_types = list(font_types)
+        self.watermark_images = {}
+        for path in watermark_image_paths:
+            self.watermark_images[path] = path
+            self.watermark_images.setdefault(os.path.basename(path), path)
+        self.timeout = timeout
+        self.max_upload_bytes = int(max_upload_mb * 1024 * 1024)
+        self.metrics = ServiceMetrics()
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.pool = self._new_pool()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=preload_watermark_assets,
+                                   initargs=(tuple(self.font_types), tuple(set(self.watermark_images.values()))))
+
+    def warm_up(self):
+        """启动全部工作进程并等待字体、水印图片加载完成"""
+        for future in [self.pool.submit(int) for _ in range(self.workers)]:
+            future.result()
+
+    def restart(self, broken_pool):
+        """进程池损坏时重建；多个请求同时发现时只重建一次"""
+        with self.lock:
+            if self.pool is broken_pool:
+                self.pool = self._new_pool()
+        broken_pool.shutdown(wait=False)
+
+    def _finished(self, pool, future):
+        with self.lock:
+            self.in_flight -= 1
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self.restart(pool)
+
+    def submit(self, image_bytes, params):
+        """
+        提交一个加水印任务
+        :return: Future，结果为 (照片字节, 格式)；没有空闲名额时返回 None
+        """
+        with self.lock:
+            if self.in_flight >= self.capacity:
+                return None
+            self.in_flight += 1
+            pool = self.pool
+        try:
+            try:
+                future = pool.submit(watermark_image_bytes, image_bytes, **params)
+            except BrokenProcessPool:
+                self.restart(pool)
+                pool = self.pool
+                future = pool.submit(watermark_image_bytes, image_bytes, **params)
+        except Exception:
+            with self.lock:
+                self.in_flight -= 1
+            raise
+        future.add_done_callback(functools.partial(self._finished, pool))
+        return future
+
+    def parse_params(self, query):
+        """
+        把查询字符串转换为 watermark_image_bytes 的参数
+        :raise RequestError: 参数不合法
+        """
+        values = {key: items[-1] for key, items in parse_qs(query, keep_blank_values=True).items()}
+
+        def integer(name, default, low, high):
+            value = values.get(name)
+            if value in (None, ''):
+                return default
+            try:
+                number = int(value)
+            except ValueError:
+                raise RequestError(f"{name} 不是整数: {value}")
+            if not low <= number <= high:
+                raise RequestError(f"{name} 应在 {low}-{high} 之间: {number}")
+            return number
+
+        watermark_type = values.get('type', 'text')
+        if watermark_type not in ('text', 'image'):
+            raise RequestError(f"未知的水印类型: {watermark_type}")
+        params = {
+            'watermark_type': watermark_type,
+            'txt_position': integer('position', 0, 0, 3),
+            'padding': integer('padding', 20, 0, 200),
+            'h_padding': integer('h_padding', 40, 0, 200),
+        }
+        if watermark_type == 'text':
+            color = values.get('color', 'FFFFFFFF')
+            if not is_color(color):
+                raise RequestError(f"字体颜色不合法: {color}")
+            font_type = values.get('font') or self.font_types[0]
+            if font_type not in self.font_types:
+                matched = [font for font in self.font_types if os.path.basename(font) == font_type]
+                if not matched:
+                    raise RequestError(f"未启用的字体: {font_type}")
+                font_type = matched[0]
+            params.update(watermark_text=values.get('text', ''), font_size=integer('font_size', 40, 1, 100),
+                          bg_alpha=integer('bg_alpha', 0, 0, 255), text_color_hex=convert_color_to_numeric(color),
+                          font_type=font_type)
+        else:
+            logo = values.get('logo')
+            if not logo:
+                raise RequestError("图片水印需要 logo 参数")
+            if logo not in self.watermark_images:
+                raise RequestError(f"未启用的水印图片: {logo}")
+            params.update(watermark_image_path=self.watermark_images[logo],
+                          watermark_width=integer('wm_width', 0, 0, 10000),
+                          watermark_height=integer('wm_height', 0, 0, 10000))
+        output_format = values.get('format')
+        if output_format:
+            if output_format.lower() not in OUTPUT_FORMATS:
+                raise RequestError(f"不支持的输出格式: {output_format}")
+            params['output_format'] = OUTPUT_FORMATS[output_format.lower()]
+        subsampling = values.get('subsampling') or 'keep'
+        if subsampling not in PHOTO_SUBSAMPLING:
+            raise RequestError(f"未知的色度抽样: {subsampling}")
+        params['encode_options'] = photo_encode_options(quality=integer('quality', 85, 1, 95),
+                                                        progressive=values.get('baseline') != '1',
+                                                        subsampling=subsampling,
+                                                        keep_metadata=values.get('strip_metadata') != '1')
+        return params
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class WatermarkRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'WatermarkServer/1.0'
+    # 保持连接，调用方可复用同一个连接连续发送请求
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if self.server.access_log:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, record, headers=None):
+        self._send(status, json.dumps(record, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8',
+                   headers)
+
+    def _send_error(self, status, message, bytes_in=0, headers=None):
+        self.service.metrics.record(status, bytes_in=bytes_in)
+        self._send_json(status, {'error': message}, headers)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/metrics':
+            record = self.service.metrics.snapshot()
+            record.update(workers=self.service.workers, capacity=self.service.capacity,
+                          in_flight=self.service.in_flight)
+            self._send_json(200, record)
+        elif path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': f"未知的路径: {path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/watermark':
+            self.close_connection = True
+            self._send_error(404, f"未知的路径: {url.path}")
+            return
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            self.close_connection = True
+            self._send_error(411, "需要 Content-Length")
+            return
+        if length > self.service.max_upload_bytes:
+            # 不读取过大的请求体，直接关闭连接
+            self.close_connection = True
+            self._send_error(413, f"照片超过 {self.service.max_upload_bytes // (1024 * 1024)} MB")
+            return
+        image_bytes = self.rfile.read(length)
+        if len(image_bytes) < length:
+            self.close_connection = True
+            return
+        try:
+            params = self.service.parse_params(url.query)
+        except (RequestError, ValueError) as e:
+            self._send_error(getattr(e, 'status', 400), str(e), length)
+            return
+        start = time.perf_counter()
+        future = self.service.submit(image_bytes, params)
+        if future is None:
+            self._send_error(503, "服务繁忙，请稍后重试", length, {'Retry-After': '1'})
+            return
+        try:
+            data, image_format = future.result(timeout=self.service.timeout)
+        except TimeoutError:
+            self._send_error(504, f"处理超过 {self.service.timeout} 秒", length)
+            return
+        except BrokenProcessPool:
+            self._send_error(500, "工作进程异常退出", length)
+            return
+        except UnidentifiedImageError:
+            self._send_error(415, "无法识别的照片格式", length)
+            return
+        except Exception as e:
+            self._send_error(500, f"处理失败: {e}", length)
+            return
+        seconds = time.perf_counter() - start
+        self.service.metrics.record(200, seconds, length, len(data))
+        self._send(200, data, CONTENT_TYPES[image_format], {'X-Processing-Seconds': f"{seconds:.3f}"})
+
+
+def is_loopback(host):
+    """判断主机名或地址是否为本机回环地址"""
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host) if ':' not in host else host).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='watermark_server', description='本机 HTTP 加水印服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址，只允许回环地址')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数，默认使用 CPU 核数')
+    parser.add_argument('--queue', dest='queue_size', type=int, default=None,
+                        help='工作进程都在处理时最多排队的请求数，超出时返回 503，默认与工作进程数相同')
+    parser.add_argument('--font', dest='font_types', action='append', default=None,
+                        help='允许使用的字体，可指定多次，第一个为默认字体（默认 simsun.ttc）')
+    parser.add_argument('--logo', dest='watermark_image_paths', action='append', default=[],
+                        help='允许使用的水印图片，可指定多次')
+    parser.add_argument('--timeout', type=float, default=60.0, help='单个请求最长处理秒数')
+    parser.add_argument('--max-upload-mb', type=float, default=50, help='上传照片的大小上限（MB）')
+    parser.add_argument('--access-log', action='store_true', help='在标准错误输出每个请求的访问日志')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not is_loopback(args.host):
+        parser.error(f"只允许监听本机回环地址: {args.host}")
+    for path in args.watermark_image_paths:
+        if not os.path.isfile(path):
+            parser.error(f"水印图片不存在: {path}")
+    service = WatermarkService(args.workers, args.queue_size, args.font_types or ['simsun.ttc'],
+                               args.watermark_image_paths, args.timeout, args.max_upload_mb)
+    server_class = ThreadingHTTPServer
+    if ':' in args.host:
+        server_class = type('ThreadingHTTPServerV6', (ThreadingHTTPServer,), {'address_family': socket.AF_INET6})
+    server = server_class((args.host, args.port), WatermarkRequestHandler)
+    server.service = service
+    server.access_log = args.access_log
+    service.warm_up()
+
+    def stop(signum, frame):
+        # serve_forever 所在线程不能直接调用 shutdown
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print(f"加水印服务已启动: http://{args.host}:{server.server_address[1]}/ ，工作进程 {service.workers} 个，"
+          f"最多同时接收 {service.capacity} 个请求", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())